@@ -0,0 +1,4 @@
+"""
+Analysis of electrophysiological recordings
+"""
+from .seal_test import *
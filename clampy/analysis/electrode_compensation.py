@@ -9,13 +9,16 @@ http://briansimulator.org/docs/electrode_compensation.html
 from scipy.optimize import fmin
 from scipy.signal import lfilter
 from scipy import linalg
-from numpy import sqrt, ceil, zeros, eye, poly, dot, hstack, array
-from scipy import zeros, array, optimize, mean, arange, diff, rand, exp, sum, convolve, eye, linalg, sqrt
+from scipy import optimize
+from scipy.fftpack import next_fast_len
+from numpy import sqrt, ceil, zeros, eye, poly, dot, hstack, array, mean, arange, diff, exp, sum, convolve, log2, conj
+from numpy.fft import rfft, irfft
+from numpy.random import rand
 import time
 
 __all__=['full_kernel', 'full_kernel_from_step',
          'electrode_kernel_soma', 'electrode_kernel_dendrite', 'solve_convolution',
-         'electrode_kernel', 'AEC_compensate', 'calibration_noise']
+         'electrode_kernel', 'AEC_compensate', 'OnlineAEC', 'calibration_noise']
 
 '''
 Active Electrode Compensation
@@ -38,24 +41,43 @@ def calibration_noise(duration, ksize):
     I_noise[-ksize:] = 0.
     return I_noise
 
-def full_kernel(v, i, ksize, full_output=False):
+def correlations(v, i, ksize, method='auto'):
+    '''
+    Returns the correlation vector <v(n)i(n-k)> and the autocorrelation vector <i(n)i(n-k)>,
+    for k < ksize.
+    method = 'direct' (loop over lags, O(ksize*N)), 'fft' (O(N*log(N))) or 'auto'
+    '''
+    if method == 'auto':
+        # Crossover estimated with dev/benchmark_full_kernel.py
+        method = 'fft' if ksize > 2*log2(len(i)) else 'direct'
+    if method == 'direct':
+        vi = zeros(ksize)
+        ii = zeros(ksize)
+        for k in range(ksize):
+            vi[k] = mean(v[k:] * i[:len(i) - k])
+            ii[k] = mean(i[k:] * i[:len(i) - k])
+    elif method == 'fft':
+        # Zero-padding avoids circular wrap-around for lags < ksize
+        n = next_fast_len(len(i) + ksize)
+        I = rfft(i, n)
+        counts = len(i) - arange(ksize) # number of terms in each mean
+        vi = irfft(rfft(v, n) * conj(I), n)[:ksize] / counts
+        ii = irfft(I * conj(I), n)[:ksize] / counts
+    else:
+        raise ValueError('Unknown method: {}'.format(method))
+    return vi, ii
+
+def full_kernel(v, i, ksize, full_output=False, method='auto'):
     '''
     Calculates the full kernel from the recording v and the input
     current i. The last ksize steps of i should be null.
     ksize = size of the resulting kernel
     full_output = returns K,v0 if True (v0 is the resting potential)
+    method = method used to calculate correlations, 'direct', 'fft' or 'auto' (chosen by size)
     '''
-    # Calculate the correlation vector <v(n)i(n-k)>
-    # and the autocorrelation vector <i(n)i(n-k)>
-    vi = zeros(ksize)
-    ii = zeros(ksize)
     vref = mean(v) # taking <v> as the reference potential simplifies the formulas
     iref = mean(i)
-    v_corrected = v-vref
-    i_corrected = i-iref
-    for k in range(ksize):
-        vi[k] = mean(v_corrected[k:] * i_corrected[:len(i) - k])
-        ii[k] = mean(i_corrected[k:] * i_corrected[:len(i) - k])
+    vi, ii = correlations(v-vref, i-iref, ksize, method)
     K = linalg.solve_toeplitz(ii, vi)
     #K = levinson_durbin(ii, vi) # obsolete
     if full_output:
@@ -75,14 +97,13 @@ def solve_convolution(K, Km):
     '''
     Solves Ke = K - Km * Ke/Re
     Linear problem
+    The matrix is lower triangular Toeplitz, i.e., K = c * Ke (convolution) with
+    c = delta + Km/Re, so that Ke is obtained by recursive deconvolution.
     '''
     Re = sum(K) - sum(Km)
-    n = len(Km)
-    A = eye(n) * (1 + Km[0] / Re)
-    for k in range(n):
-        for m in range(k):
-            A[k, m] = Km[k - m] / Re
-    return linalg.lstsq(A, K)[0]
+    c = Km / Re
+    c[0] += 1
+    return lfilter([1.], c, K)
 
 def electrode_kernel_dendrite(Karg, start_tail, full_output=False):
     '''
@@ -231,6 +252,43 @@ def AEC_compensate(v, i, ke):
     '''
     return v - convolve(ke, i)[:-(len(ke) - 1)]
 
+class OnlineAEC(object):
+    '''
+    Active Electrode Compensation, done online on consecutive blocks
+    (e.g. from a continuous acquisition, see `Board.stream`).
+    The electrode response to the end of each block is carried over to the next blocks,
+    so that the concatenated output is the same as with `AEC_compensate` on the whole recording.
+
+    Example:
+
+        aec = OnlineAEC(ke)
+        with board.stream('V', 'I', block_size=1000) as stream:
+            for V, I in stream.blocks():
+                Vm = aec.compensate(V, I)
+    '''
+    def __init__(self, ke):
+        '''
+        Parameters
+        ----------
+        ke : electrode kernel
+        '''
+        self.ke = array(ke, dtype=float)
+        self.reset()
+
+    def reset(self):
+        '''
+        Forgets the past current (e.g. at the start of a new recording).
+        '''
+        self.zi = zeros(len(self.ke) - 1)
+
+    def compensate(self, v, i):
+        '''
+        Returns the compensated potential for a block of recorded potential v
+        and injected current i.
+        '''
+        ve, self.zi = lfilter(self.ke, [1.], i, zi=self.zi)
+        return v - ve
+
 def levinson_durbin(a, y):
     '''
     Solves AX=Y where A is a symetrical Toeplitz matrix with coefficients
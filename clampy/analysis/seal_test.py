@@ -0,0 +1,148 @@
+'''
+Online analysis of the response to a test pulse (seal test, membrane test).
+
+Index windows are calculated once from the command, so that each sweep is analyzed with a few
+operations over short windows. Baseline and steady state are medians, which are robust to spontaneous
+events and spikes in the windows. Results of the last sweeps are kept in a rolling history.
+
+In voltage clamp, with a step dV, the current is a transient decaying to a steady state:
+* resistance = dV / (Iss - I0) (total resistance: seal, or access + membrane)
+* access resistance = dV / (Ipeak - I0)
+* membrane resistance = resistance - access resistance
+* capacitance = tau * (Ra + Rm) / (Ra * Rm), with Ra the access and Rm the membrane resistance,
+  where tau = integral(I - Iss) / (Ipeak - Iss) is the decay time constant.
+
+In current clamp, with a step dI, the potential relaxes to a steady state:
+* resistance = (Vss - V0) / dI
+* capacitance = tau / resistance, where tau = integral(Vss - V) / (Vss - V0).
+The access resistance cannot be measured in current clamp (it is nan).
+'''
+import numpy as np
+
+__all__ = ['SealTest']
+
+class SealTest(object):
+    '''
+    Analyzes responses to a test pulse.
+
+    Example:
+
+        seal_test = SealTest(Vc, dt)
+        I = board.acquire('I', Vc=Vc)
+        results = seal_test.analyze(I)
+        print(results['resistance'])
+    '''
+    fields = ['baseline', 'steady_state', 'resistance', 'access_resistance', 'membrane_resistance', 'capacitance']
+
+    def __init__(self, command, dt, voltage_clamp=True, steady_state=1/3., history=1000):
+        '''
+        Parameters
+        ----------
+        command : the command, constant except for a single pulse
+        dt : sampling step
+        voltage_clamp : True if the command is a voltage, False if it is a current
+        steady_state : final fraction of the pulse where the steady state is measured
+        history : number of sweeps kept in the history
+        '''
+        command = np.asarray(command)
+        pulse = np.nonzero(command != command[0])[0]
+        if len(pulse) == 0:
+            raise ValueError('The command has no pulse')
+        start, end = pulse[0], pulse[-1] + 1
+        if start == 0 or end - start < 2:
+            raise ValueError('The command must start with a baseline and the pulse must last at least 2 samples')
+        self.dt = float(dt)
+        self.amplitude = command[start] - command[0]
+        self.voltage_clamp = voltage_clamp
+        self.nsamples = len(command)
+        # Index windows
+        steady_start = end - max(int((end - start) * steady_state), 1)
+        self.baseline_window = slice(0, start)
+        self.transient_window = slice(start, steady_start)
+        self.steady_window = slice(steady_start, end)
+        self.pulse_window = slice(start, end)
+        # History
+        self.history = np.full((history, len(self.fields)), np.nan)
+        self.times = np.full(history, np.nan)
+        self.count = 0 # number of analyzed sweeps
+        self.last = None
+
+    def analyze(self, response, amplitude=None, t=None):
+        '''
+        Analyzes a response and adds the results to the history.
+
+        Parameters
+        ----------
+        response : the current (voltage clamp) or voltage (current clamp)
+        amplitude : amplitude of the pulse, if different from the command given at initialization
+                    (results are nan if it is 0)
+        t : time of the sweep, stored in the history (default: sweep number)
+
+        Returns
+        -------
+        A dictionary of results (see `fields`).
+        '''
+        if len(response) < self.nsamples:
+            raise ValueError('The response has {} samples, the command has {}'.format(len(response), self.nsamples))
+        if amplitude is None:
+            amplitude = self.amplitude
+        response = np.asarray(response)
+        baseline = np.median(response[self.baseline_window])
+        steady_state = np.median(response[self.steady_window])
+        values = dict(baseline=baseline, steady_state=steady_state,
+                      resistance=np.nan, access_resistance=np.nan,
+                      membrane_resistance=np.nan, capacitance=np.nan)
+        if amplitude != 0:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if self.voltage_clamp:
+                    values.update(self.voltage_clamp_analysis(response, amplitude, baseline, steady_state))
+                else:
+                    values.update(self.current_clamp_analysis(response, amplitude, baseline, steady_state))
+        self.record(values, t)
+        return values
+
+    def voltage_clamp_analysis(self, I, dV, I0, Iss):
+        transient = I[self.transient_window]
+        # Peak of the transient, in the direction of the pulse
+        if (Iss - I0) * dV >= 0:
+            Ipeak = transient.max() if dV > 0 else transient.min()
+        else: # unusual sign, e.g. no cell
+            Ipeak = transient[np.argmax(abs(transient - I0))]
+        R = dV / (Iss - I0)
+        Ra = dV / (Ipeak - I0)
+        Rm = R - Ra
+        tau = (I[self.pulse_window] - Iss).sum() * self.dt / (Ipeak - Iss)
+        C = tau * (Ra + Rm) / (Ra * Rm)
+        return dict(resistance=R, access_resistance=Ra, membrane_resistance=Rm, capacitance=C)
+
+    def current_clamp_analysis(self, V, dI, V0, Vss):
+        R = (Vss - V0) / dI
+        tau = (Vss - V[self.pulse_window]).sum() * self.dt / (Vss - V0)
+        return dict(resistance=R, membrane_resistance=R, capacitance=tau / R)
+
+    def record(self, values, t=None):
+        i = self.count % len(self.history)
+        self.history[i] = [values[field] for field in self.fields]
+        self.times[i] = self.count if t is None else t
+        self.count += 1
+        self.last = values
+
+    def trend(self, field=None):
+        '''
+        Returns the times and values of the history in chronological order, for one field
+        or all fields (sweeps x fields).
+        '''
+        n = len(self.history)
+        index = np.arange(max(self.count - n, 0), self.count) % n
+        if field is None:
+            return self.times[index], self.history[index]
+        return self.times[index], self.history[index, self.fields.index(field)]
+
+    def reset(self):
+        '''
+        Clears the history.
+        '''
+        self.history[:] = np.nan
+        self.times[:] = np.nan
+        self.count = 0
+        self.last = None
@@ -3,14 +3,24 @@ Imported from Brian 1:
 http://briansimulator.org/docs/traceanalysis.html
 
 Analysis of spikes in voltage traces.
+
+Per-spike quantities are calculated with array operations on the whole trace,
+rather than loops over spikes. All features can be obtained at once with `spike_features`.
+
+Functions starting with `batch_` analyse a trials x time matrix (as returned by `load_dataset`),
+optionally with a pool of processes. Since the number of spikes varies across trials, results are returned
+as a flat array together with trial offsets: the results of trial k are values[offsets[k]:offsets[k+1]].
 """
+from functools import partial
+from multiprocessing import Pool
 from numpy import *
 from scipy import optimize
 from scipy.signal import lfilter, lfiltic
 
 __all__ = ['find_spike_criterion', 'spike_peaks', 'spike_onsets', 'find_onset_criterion',
          'slope_threshold', 'vm_threshold', 'spike_shape', 'spike_duration', 'reset_potential',
-         'spike_mask', 'lowpass']
+         'spike_mask', 'lowpass', 'spike_features',
+         'batch_apply', 'batch_spike_peaks', 'batch_spike_onsets', 'batch_spike_features']
 
 def lowpass(x, tau, dt=1.):
     """
@@ -19,7 +29,53 @@ def lowpass(x, tau, dt=1.):
     a = exp(-dt / tau)
     return lfilter([1. - a], [1., -a], x)#, zi=lfiltic([1. - a], [1., -a],array([x[0]]),array([x[0]])))
 
-def spike_duration(v, onsets=None, full=False):
+def _first_in(indexes, starts, ends, default):
+    """
+    For each interval [starts[k], ends[k]), returns the first element of the sorted array indexes
+    in the interval, or default[k] if there is none.
+    """
+    pos = searchsorted(indexes, starts)
+    found = append(indexes, -1)[pos]
+    return where((pos < len(indexes)) & (found >= starts) & (found < ends), found, default)
+
+def _search_forward(test, starts, lengths, window=16):
+    """
+    For each k, returns the first step s < lengths[k] such that test(starts[k] + s, k) is True, or -1 if there is none.
+    test is called with 2D arrays of indexes and of spike numbers.
+    The search is done in windows of increasing size, as spikes are short compared to interspike intervals.
+    """
+    starts = asarray(starts, dtype=int)
+    lengths = maximum(lengths, 0)
+    steps = -ones(len(starts), dtype=int)
+    pending = arange(len(starts))
+    while len(pending) > 0:
+        step = arange(window)[None, :]
+        result = test(starts[pending, None] + step, pending[:, None]) & (step < lengths[pending, None])
+        found = result.any(axis=1)
+        steps[pending[found]] = result[found].argmax(axis=1)
+        pending = pending[~found & (lengths[pending] > window)]
+        window *= 4
+    return steps
+
+def _next_spikes(spikes, n):
+    """
+    Index of the next spike for each spike (n for the last one).
+    """
+    return append(spikes[1:], n).astype(int)
+
+def _local_minima(dv):
+    """
+    Indexes m such that v has a local minimum at m+1 (dv[m]<=0 and dv[m+1]>0).
+    """
+    return ((dv[:-1] <= 0) & (dv[1:] > 0)).nonzero()[0]
+
+def _next_minimum(starts, next_spike, dv):
+    """
+    Number of steps from each start to the next local minimum of v, before the next spike (0 if there is none).
+    """
+    return _first_in(_local_minima(dv), starts, next_spike - 1, starts) - starts
+
+def spike_duration(v, onsets=None, full=False, dv=None):
     '''
     Average spike duration.
     Default: time from onset to next minimum.
@@ -30,43 +86,50 @@ def spike_duration(v, onsets=None, full=False):
     * Standard deviations for these 3 values
     '''
     if onsets is None: onsets = spike_onsets(v)
-    dv = diff(v)
-    total_duration = []
-    time_to_peak = []
-    spike_width = []
-    for i, spike in enumerate(onsets):
-        if i == len(onsets) - 1:
-            next_spike = len(dv)
-        else:
-            next_spike = onsets[i + 1]
-        total_duration.append(((dv[spike:next_spike - 1] <= 0) & (dv[spike + 1:next_spike] > 0)).argmax())
-        time_to_peak.append((dv[spike:next_spike] <= 0).argmax())
-        spike_width.append((v[spike + 1:next_spike] <= v[spike]).argmax())
+    time_to_peak, spike_width, total_duration = _spike_durations(v, onsets, dv)
     if full:
         return mean(time_to_peak), mean(spike_width), mean(total_duration), \
                std(time_to_peak), std(spike_width), std(total_duration)
     else:
         return mean(total_duration)
 
-def reset_potential(v, peaks=None, full=False):
+def _spike_durations(v, onsets, dv=None):
+    """
+    Time to peak, spike width and total duration of each spike.
+    """
+    if dv is None: dv = diff(v)
+    onsets = asarray(onsets, dtype=int)
+    next_spike = _next_spikes(onsets, len(dv))
+    # Time to peak: onset to first decrease
+    time_to_peak = _first_in((dv <= 0).nonzero()[0], onsets, next_spike, onsets) - onsets
+    # Width: first time after onset when v goes back to v[onset] (v increases until the peak)
+    peaks = onsets + time_to_peak
+    back = _search_forward(lambda i, k: v[minimum(i + 1, len(v) - 1)] <= v[onsets[k]], peaks, next_spike - peaks - 1)
+    spike_width = where(back >= 0, back + time_to_peak, 0)
+    # Total duration: onset to next minimum
+    total_duration = _next_minimum(onsets, next_spike, dv)
+    return time_to_peak, spike_width, total_duration
+
+def reset_potential(v, peaks=None, full=False, dv=None):
     '''
     Average reset potential, calculated as next minimum after spike peak.
     If full is True, also returns the standard deviation.
     '''
     if peaks is None: peaks = spike_peaks(v)
-    dv = diff(v)
-    reset = []
-    for i, spike in enumerate(peaks):
-        if i == len(peaks) - 1:
-            next_spike = len(dv)
-        else:
-            next_spike = peaks[i + 1]
-        reset.append(v[spike + ((dv[spike:next_spike - 1] <= 0) & (dv[spike + 1:next_spike] > 0)).argmax() + 1])
+    reset = _reset_potentials(v, peaks, dv)
     if full:
         return mean(reset), std(reset)
     else:
         return mean(reset)
 
+def _reset_potentials(v, peaks, dv=None):
+    """
+    Potential at the next minimum after each peak.
+    """
+    if dv is None: dv = diff(v)
+    peaks = asarray(peaks, dtype=int)
+    return v[peaks + _next_minimum(peaks, _next_spikes(peaks, len(dv)), dv) + 1]
+
 def find_spike_criterion(v):
     '''
     This is a rather complex method to determine above which voltage vc
@@ -83,58 +146,123 @@ def find_spike_criterion(v):
     i = argmax(diff(vc)) # I think there is a mistake, I should sort vc first
     return .5 * (vc[i] + vc[i + 1])
 
-def spike_peaks(v, vc=None):
+def spike_peaks(v, vc=None, dv=None):
     '''
     Returns the indexes of spike peaks.
     vc is the spike criterion (voltage above which we consider we have a spike)
     '''
     # Possibly: add refractory criterion
     if vc is None: vc = find_spike_criterion(v)
-    dv = diff(v)
+    if dv is None: dv = diff(v)
     spikes = ((v[1:] > vc) & (v[:-1] < vc)).nonzero()[0]
-    peaks = []
-    if len(spikes) > 0:
-        for i in range(len(spikes) - 1):
-            peaks.append(spikes[i] + (dv[spikes[i]:spikes[i + 1]] <= 0).nonzero()[0][0])
-        decreasing = (dv[spikes[-1]:] <= 0).nonzero()[0]
-        if len(decreasing) > 0:
-            peaks.append(spikes[-1] + decreasing[0])
-        else:
-            peaks.append(len(dv)) # last element (maybe should be deleted?)
-    return array(peaks)
-
-def spike_onsets(v, criterion=None, vc=None):
+    # First decrease after each crossing; if there is none after the last one, last element (maybe should be deleted?)
+    return _first_in((dv <= 0).nonzero()[0], spikes, len(dv), len(dv))
+
+def spike_onsets(v, criterion=None, vc=None, dv=None, d2v=None, peaks=None, guess=0.0001):
     '''
     Returns the indexes of spike onsets.
     vc is the spike criterion (voltage above which we consider we have a spike).
     First derivative criterion (dv>criterion).
+    dv, d2v and peaks can be passed if they have already been calculated.
+    guess is the initial guess of the criterion, if it is not given (see `find_onset_criterion`).
     '''
     if vc is None: vc = find_spike_criterion(v)
-    if criterion is None: criterion = find_onset_criterion(v, vc=vc)
-    peaks = spike_peaks(v, vc)
-    dv = diff(v)
-    d2v = diff(dv)
-    previous_i = 0
-    j = 0
-    l = []
+    if dv is None: dv = diff(v)
+    if d2v is None: d2v = diff(dv)
+    if peaks is None: peaks = spike_peaks(v, vc, dv)
+    if criterion is None: criterion = find_onset_criterion(v, guess, vc=vc, dv=dv, d2v=d2v, peaks=peaks)
+    return _onsets(dv, _inflexions(d2v, peaks), criterion)
+
+def _inflexions(d2v, peaks):
+    """
+    Last inflexion point of v before each peak, and after the previous peak.
+    """
+    # Find last peak of derivative (commented: point where derivative is largest)
+    # inflexion = previous_i + argmax(dv[previous_i:i])
+    changes = (d2v[:-1] * d2v[1:] < 0).nonzero()[0]
+    previous = append(0, peaks[:-1])
+    pos = searchsorted(changes, peaks - 2) - 1
+    if any(pos < 0) or any(changes[pos] < previous):
+        raise ValueError('No inflexion point before spike peak')
+    return changes[pos] + 2
 
-    for i in peaks:
-        # Find last peak of derivative (commented: point where derivative is largest)
-        # inflexion = previous_i + argmax(dv[previous_i:i])
-        inflexion=where(d2v[previous_i:i-2]*d2v[previous_i+1:i-1]<0)[0][-1]+2+previous_i
-        j += max((dv[j:inflexion] < criterion).nonzero()[0]) + 1
-        l.append(j)
-        previous_i = i
+def _onsets(dv, inflexions, criterion):
+    """
+    Spike onsets, last time before each inflexion point when dv < criterion, plus one.
+    """
+    below = (dv < criterion).nonzero()[0]
+    pos = searchsorted(below, inflexions) - 1
+    onsets = append(below, 0)[pos] + 1
+    # The search stops at the previous onset
+    if any(pos < 0) or any(onsets[1:] <= onsets[:-1]):
+        raise ValueError('Spike onset not found for criterion {}'.format(criterion))
+    return onsets
+
+def _onset_candidates(dv, inflexions):
+    """
+    Possible onsets of each spike, whatever the criterion: walking back from the inflexion point to the previous one,
+    points where dv reaches a new minimum.
+    Returns their indexes, their values of dv, their spike numbers, and the position of the first candidate of each spike.
+    """
+    bounds = append(0, inflexions)
+    indexes, values = [], []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        segment = dv[start:end][::-1]
+        minima = minimum.accumulate(segment)
+        new = append(True, minima[1:] < minima[:-1]).nonzero()[0]
+        indexes.append(end - 1 - new)
+        values.append(segment[new])
+    counts = [len(x) for x in indexes]
+    return concatenate(indexes).astype(int), concatenate(values), repeat(arange(len(counts)), counts), \
+           cumsum([0] + counts)
 
-    return array(l)
+def _candidate_onsets(candidates, criterion):
+    """
+    Same as _onsets, using the possible onsets of each spike: the onset is the first candidate with dv < criterion.
+    """
+    indexes, values, spike, first = candidates
+    # Values are decreasing for each spike
+    n_above = bincount(spike[values >= criterion], minlength=len(first) - 1)
+    if any(first[:-1] + n_above == first[1:]):
+        raise ValueError('Spike onset not found for criterion {}'.format(criterion))
+    return indexes[first[:-1] + n_above] + 1
 
-def find_onset_criterion(v, guess=0.0001, vc=None):
+def find_onset_criterion(v, guess=0.0001, vc=None, dv=None, d2v=None, peaks=None, grid=None):
     '''
     Finds the best criterion on dv/dt to determine spike onsets,
     based on minimum threshold variability.
+    The criterion is first searched on a grid (by default, from guess/10 to 10*guess,
+    then from guess/1000 to 1000*guess if no criterion gives onsets for all spikes),
+    then refined by minimization.
+    Raises a ValueError if no criterion on the grid gives spike onsets.
     '''
     if vc is None: vc = find_spike_criterion(v)
-    return float(optimize.fmin(lambda x:std(v[spike_onsets(v, x, vc)]), guess, disp=0))
+    if dv is None: dv = diff(v)
+    if d2v is None: d2v = diff(dv)
+    if peaks is None: peaks = spike_peaks(v, vc, dv)
+    if len(peaks) == 0: # no spike
+        return guess
+    default_grid = grid is None
+    if default_grid: grid = guess * logspace(-1, 1, 21)
+    candidates = _onset_candidates(dv, _inflexions(d2v, peaks))
+
+    def threshold_variability(criterion):
+        try:
+            return std(v[_candidate_onsets(candidates, criterion)])
+        except ValueError: # onsets not found
+            return inf
+
+    variability = [threshold_variability(criterion) for criterion in grid]
+    if all(isinf(variability)) and default_grid: # wider grid
+        grid = guess * logspace(-3, 3, 61)
+        variability = [threshold_variability(criterion) for criterion in grid]
+    if all(isinf(variability)):
+        raise ValueError('No onset criterion found around guess {}'.format(guess))
+    best = grid[argmin(variability)]
+    refined = float(optimize.fmin(threshold_variability, best, disp=0))
+    if isinf(threshold_variability(refined)):
+        return float(best)
+    return refined
 
 def spike_shape(v, onsets=None, before=100, after=100):
     '''
@@ -157,10 +285,16 @@ def vm_threshold(v, onsets=None, T=None):
     Average membrane potential before spike threshold (T steps).
     '''
     if onsets is None: onsets = spike_onsets(v)
-    l = []
-    for i in onsets:
-        l.append(mean(v[max(0, i - T):i]))
-    return array(l)
+    index, valid = _windows_before(onsets, T)
+    return sum(where(valid, v[index], 0), axis=1) / sum(valid, axis=1)
+
+def _windows_before(onsets, T):
+    """
+    Indexes of the T steps before each onset (onsets x T), and mask of valid indexes (>=0).
+    """
+    index = asarray(onsets, dtype=int)[:, None] + arange(-T, 0)[None, :]
+    valid = index >= 0
+    return where(valid, index, 0), valid
 
 def slope_threshold(v, onsets=None, T=None):
     '''
@@ -168,14 +302,10 @@ def slope_threshold(v, onsets=None, T=None):
     Returns all slopes as an array.
     '''
     if onsets is None: onsets = spike_onsets(v)
-    l = []
-    for i in onsets:
-        v0 = v[max(0, i - T):i]
-        M = len(v0)
-        x = arange(M) - M + 1
-        slope = sum((v0 - v[i]) * x) / sum(x ** 2)
-        l.append(slope)
-    return array(l)
+    onsets = asarray(onsets, dtype=int)
+    index, valid = _windows_before(onsets, T)
+    x = where(valid, index - onsets[:, None] + 1, 0) # 0 at the last step
+    return sum((v[index] - v[onsets][:, None]) * x, axis=1) / sum(x ** 2, axis=1)
 
 def spike_mask(v, spikes=None, T=None):
     '''
@@ -188,15 +318,100 @@ def spike_mask(v, spikes=None, T=None):
       v=v[-spike_mask(v)] # subthreshold trace
     '''
     if spikes is None: spikes = spike_onsets(v)
-    ind = (v == 1e9)
+    spikes = asarray(spikes, dtype=int)
     if T is None:
         dv = diff(v)
-        for i, spike in enumerate(spikes):
-            if i == len(spikes) - 1: next_spike = len(dv)
-            else: next_spike = spikes[i + 1]
-            T = ((dv[spike:next_spike - 1] <= 0) & (dv[spike + 1:next_spike] > 0)).argmax()
-            ind[spike:spike + T + 1] = True
+        ends = spikes + _next_minimum(spikes, _next_spikes(spikes, len(dv)), dv) + 1
     else: # fixed duration
-        for i in spikes:
-            ind[i:i + T] = True
+        ends = spikes + T
+    # Mark intervals [spikes, ends)
+    lengths = maximum(minimum(ends, len(v)) - spikes, 0)
+    ind = zeros(len(v), dtype=bool)
+    ind[repeat(spikes - cumsum(lengths) + lengths, lengths) + arange(lengths.sum())] = True
     return ind
+
+def spike_features(v, criterion=None, vc=None, T=None, guess=0.0001):
+    '''
+    Calculates the features of all spikes, with derivatives calculated only once.
+    Returns a structured array with one element per spike and fields:
+    * onset: index of spike onset
+    * peak: index of spike peak
+    * threshold: potential at onset
+    * time_to_peak: number of steps from onset to peak
+    * width: number of steps from onset down to the onset potential
+    * duration: number of steps from onset to next minimum
+    * reset: potential at the minimum after the peak
+    * vm, slope: average and slope of the potential in the T steps before onset (if T is given)
+    If criterion is not given, it is found with `find_onset_criterion`, starting from guess.
+
+    Ex:
+      features = spike_features(v)
+      mean(features['threshold'])
+    '''
+    if vc is None: vc = find_spike_criterion(v)
+    dv = diff(v)
+    d2v = diff(dv)
+    peaks = spike_peaks(v, vc, dv)
+    onsets = spike_onsets(v, criterion, vc, dv=dv, d2v=d2v, peaks=peaks, guess=guess)
+    fields = [('onset', int), ('peak', int), ('threshold', float), ('time_to_peak', int),
+              ('width', int), ('duration', int), ('reset', float)]
+    if T is not None:
+        fields += [('vm', float), ('slope', float)]
+    features = zeros(len(onsets), dtype=fields)
+    features['onset'] = onsets
+    features['peak'] = peaks
+    features['threshold'] = v[onsets]
+    features['time_to_peak'], features['width'], features['duration'] = _spike_durations(v, onsets, dv)
+    features['reset'] = _reset_potentials(v, peaks, dv)
+    if T is not None:
+        features['vm'] = vm_threshold(v, onsets, T)
+        features['slope'] = slope_threshold(v, onsets, T)
+    return features
+
+def batch_apply(function, V, processes=1, **kwds):
+    '''
+    Applies an analysis function to each trial, and returns the list of results.
+
+    Parameters
+    ----------
+    function : a function of a 1D trace, defined at module level (so that it can be sent to other processes)
+    V : trials x time matrix
+    processes : number of processes (1: no pool, None: number of CPUs)
+    kwds : keyword arguments passed to the function
+    '''
+    function = partial(function, **kwds)
+    if processes == 1:
+        return [function(v) for v in V]
+    with Pool(processes) as pool:
+        return pool.map(function, V)
+
+def _ragged(results):
+    """
+    Concatenates per-trial arrays into a flat array and trial offsets.
+    """
+    offsets = cumsum([0] + [len(x) for x in results])
+    return concatenate(results), offsets
+
+def batch_spike_peaks(V, vc=None, processes=1):
+    '''
+    Indexes of spike peaks in all trials, as a flat array and trial offsets.
+    The spike criterion vc is calculated for each trial if not given.
+    '''
+    return _ragged([asarray(x, dtype=int) for x in batch_apply(spike_peaks, V, processes, vc=vc)])
+
+def batch_spike_onsets(V, criterion=None, vc=None, processes=1, guess=0.0001):
+    '''
+    Indexes of spike onsets in all trials, as a flat array and trial offsets.
+    The criteria are calculated for each trial if not given.
+    '''
+    return _ragged([asarray(x, dtype=int) for x in batch_apply(spike_onsets, V, processes, criterion=criterion, vc=vc, guess=guess)])
+
+def batch_spike_features(V, criterion=None, vc=None, T=None, processes=1, guess=0.0001):
+    '''
+    Features of all spikes in all trials (see `spike_features`), as a flat structured array and trial offsets.
+
+    Ex:
+      features, offsets = batch_spike_features(signals['V'], processes=None)
+      trial = repeat(arange(len(offsets) - 1), diff(offsets)) # trial of each spike
+    '''
+    return _ragged(batch_apply(spike_features, V, processes, criterion=criterion, vc=vc, T=T, guess=guess))
@@ -1,7 +1,10 @@
 '''
 This is AEC straight from the original paper.
 '''
-from scipy import convolve, optimize, zeros, mean, exp, array, arange, diff, Inf
+from __future__ import print_function
+from scipy import optimize
+from scipy.signal import lfilter
+from numpy import convolve, zeros, mean, exp, array, arange, diff, inf, sum
 
 __all__ = ['AEC_compensate', 'full_kernel', 'full_kernel_from_step', 'electrode_kernel']
 
@@ -68,10 +71,8 @@ def electrode_kernel(Karg, start_tail, full_output=False):
 
         alpha = x / tau
         lambd = exp(-1. / tau)
-        Y = zeros(len(RawK))
-        Y[0] = alpha / (alpha + 1.) * RawK[0]
-        for i in range(1, len(RawK)):
-            Y[i] = (alpha * RawK[i] + lambd * Y[i - 1]) / (1 + alpha)
+        # Y[i] = (alpha * RawK[i] + lambd * Y[i - 1]) / (1 + alpha), with Y[-1] = 0
+        Y = lfilter([alpha / (1 + alpha)], [1., -lambd / (1 + alpha)], RawK)
         Kel = RawK - Y
         err = sum(Kel[tail] ** 2)
         return (err, Kel)
@@ -83,14 +84,14 @@ def electrode_kernel(Karg, start_tail, full_output=False):
     # Membrane time constant
     tau = result['tau']  # in units of the bin size
     f = lambda x: result['f'](x) * exp(start_tail / tau)
-    print 'tau =',tau
+    print('tau =', tau)
 
     # Replace tail by fit (reduces noise)
     K[tail] = f(array(tail))
 
     # Find first local minimum
     # Gross estimate
-    zmin = Inf
+    zmin = inf
     r = 1.1
     x0 = .1
     for _ in range(70):
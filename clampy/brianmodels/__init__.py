@@ -1,2 +1,7 @@
-from .brianmodels import *
-from .RC_models import *
\ No newline at end of file
+from warnings import warn
+from .linear_models import *
+try:
+    from .brianmodels import *
+    from .RC_models import *
+except ImportError:
+    warn('Brian 2 could not be imported: only linear models are available')
@@ -7,6 +7,7 @@ __all__ = ['BrianExperiment', 'TwoCompartmentModel', 'SpatialBrianExperiment', '
 
 from brian2 import *
 from clampy.devices import Board
+import gc
 
 class BrianExperiment(Board):
     '''
@@ -14,7 +15,10 @@ class BrianExperiment(Board):
 
     The equations must include V (membrane potential) and I (injected current).
     '''
-    def __init__(self, eqs = None, namespace = None, gclamp = 10*usiemens, dt = 0.1*ms, method='exponential_euler'):
+    freeze_gc = False
+
+    def __init__(self, eqs = None, namespace = None, gclamp = 10*usiemens, dt = 0.1*ms, method='exponential_euler',
+                 freeze_gc=False):
         '''
         Parameters
         ----------
@@ -22,9 +26,17 @@ class BrianExperiment(Board):
         namespace : namespace of the model
         gclamp : gain of the voltage-clamp
         dt : sampling step (not the same as the simulation time step)
+        freeze_gc : if True, gc.freeze() is called after the first sweep. Brian runs a full garbage collection
+                    at each run, which takes most of the time of short sweeps; freezing excludes all objects
+                    existing at that time (including those of the user) from garbage collection,
+                    for the rest of the process.
         '''
         Board.__init__(self)
+        self.freeze_gc = freeze_gc
         self.alias = dict() # dictionary of aliases (mapping from alias to channel name)
+        self.model_eqs = eqs
+        self.namespace = namespace
+        self.method = method
         self.eqs = Equations(eqs+'''
         I = Icommand(t-t_start) + Iclamp : amp
         Iclamp = gclamp*(Vcommand(t-t_start)-V) : amp
@@ -39,6 +51,17 @@ class BrianExperiment(Board):
 
         self.configure_board()
         self.is_voltage_clamp = False # Initially in current clamp
+        self.init_recording()
+
+    def init_recording(self):
+        '''
+        Creates the command arrays, which are kept between acquisitions together with the monitor,
+        so that the generated code does not change from one sweep to the next (and is not recompiled).
+        '''
+        self.Vcommand = TimedArray([0 * volt], dt=self.dt, name='Vclamp')
+        self.Icommand = TimedArray([0 * amp], dt=self.dt, name='Iclamp')
+        self.monitor = None
+        self.gc_frozen = False
 
     def configure_board(self):
         # Expose all variables
@@ -53,6 +76,20 @@ class BrianExperiment(Board):
     def voltage_clamp(self, channel=None):
         self.is_voltage_clamp = True
 
+    def update_command(self, command, values, name):
+        '''
+        Returns a TimedArray with the given values (None for zero), updating `command` in place
+        if possible (same length).
+        '''
+        if values is None:
+            command.values[:] = 0
+            return command
+        elif len(command.values) == len(values):
+            command.values[:] = asarray(values)
+            return command
+        else:
+            return TimedArray(values.copy(), dt=self.dt, name=name)
+
     def acquire_raw(self, analog_inputs=None, analog_outputs=None, digital_inputs=None, digital_outputs=None, input_range={}):
         '''
         Send commands and acquire signals.
@@ -71,30 +108,77 @@ class BrianExperiment(Board):
             nsamples = len(list(digital_outputs.values())[0])
 
         self.neuron.t_start = self.network.t
+        self.Vcommand = self.update_command(self.Vcommand, analog_outputs.get('Vc'), 'Vclamp')
+        self.Icommand = self.update_command(self.Icommand, analog_outputs.get('Ic'), 'Iclamp')
+        if ('Vc' in analog_outputs) and not ('Ic' in analog_outputs): # Automatic mode switch
+            self.voltage_clamp()
+        elif ('Ic' in analog_outputs) and not ('Vc' in analog_outputs):
+            self.current_clamp()
+
+        self.neuron.gclamp[0] = self.gclamp * self.is_voltage_clamp
+
+        # The monitor is rebuilt only if the recorded variables change
+        if (self.monitor is None) or (self.monitor.record_variables != list(analog_inputs)):
+            if self.monitor is not None:
+                self.network.remove(self.monitor)
+            self.monitor = StateMonitor(self.neuron, analog_inputs, record=[0], dt = self.dt)
+            self.network.add(self.monitor)
+        else:
+            self.monitor.resize(0)
+        self.network.run(nsamples * self.dt, namespace=dict(Vcommand=self.Vcommand, Icommand=self.Icommand))
+        if self.freeze_gc and not self.gc_frozen and hasattr(gc, 'freeze'): # Python 3.7+
+            gc.freeze()
+            self.gc_frozen = True
+
+        # Copies, since the monitor is reused
+        results = [self.monitor[0].__getattr__(name).copy() for name in analog_inputs]
+
+        return results
+
+    def acquire_batch_raw(self, analog_inputs=None, analog_outputs=None, input_range={}):
+        '''
+        Simulates all trials at once, with one neuron per trial, starting from the current state of the model.
+        The state of the model is not changed.
+
+        Parameters
+        ----------
+        analog_inputs
+            A list of input variables to acquire.
+        analog_outputs
+            A dictionary of commands (trials x samples).
+        '''
+        ntrials, nsamples = list(analog_outputs.values())[0].shape
+
+        eqs = Equations(self.model_eqs+'''
+        I = Icommand(t-t_start, i) + Iclamp : amp
+        Iclamp = gclamp*(Vcommand(t-t_start, i)-V) : amp
+        gclamp : siemens
+        t_start : second
+        ''')
         if 'Vc' in analog_outputs:
-            Vcommand = TimedArray(analog_outputs['Vc'], dt=self.dt, name='Vclamp')
+            Vcommand = TimedArray(analog_outputs['Vc'].T, dt=self.dt)
             if not 'Ic' in analog_outputs: # Automatic mode switch
                 self.voltage_clamp()
         else:
-            Vcommand = TimedArray([0 * volt], dt=self.dt, name='Vclamp')
+            Vcommand = TimedArray(zeros((1, ntrials)) * volt, dt=self.dt)
         if 'Ic' in analog_outputs:
-            Icommand = TimedArray(analog_outputs['Ic'], dt=self.dt, name='Iclamp')
+            Icommand = TimedArray(analog_outputs['Ic'].T, dt=self.dt)
             if not 'Vc' in analog_outputs:
                 self.current_clamp()
         else:
-            Icommand = TimedArray([0 * amp], dt=self.dt, name='Iclamp')
-
-        self.neuron.gclamp[0] = self.gclamp * self.is_voltage_clamp
-
-        self.monitor = StateMonitor(self.neuron, analog_inputs, record=[0], dt = self.dt)
-        self.network.add(self.monitor)
-        self.network.run(nsamples * self.dt)
+            Icommand = TimedArray(zeros((1, ntrials)) * amp, dt=self.dt)
 
-        results = [self.monitor[0].__getattr__(name) for name in analog_inputs]
+        neurons = NeuronGroup(ntrials, eqs, namespace=self.namespace, method=self.method)
+        # Copy the current state
+        for name in self.eqs.diff_eq_names | (self.eqs.parameter_names - {'gclamp', 't_start'}):
+            setattr(neurons, name, getattr(self.neuron, name)[0])
+        neurons.gclamp = self.gclamp * self.is_voltage_clamp
 
-        self.network.remove(self.monitor)
+        monitor = StateMonitor(neurons, analog_inputs, record=True, dt=self.dt)
+        network = Network(neurons, monitor)
+        network.run(nsamples * self.dt, namespace=dict(Vcommand=Vcommand, Icommand=Icommand))
 
-        return results
+        return [getattr(monitor, name)[:, :nsamples] for name in analog_inputs]
 
 class TwoCompartmentModel(BrianExperiment):
     '''
@@ -314,6 +398,10 @@ class SpatialBrianExperiment(BrianExperiment):
 
         self.configure_board()
         self.is_voltage_clamp = False # Initially in current clamp
+        self.init_recording()
+
+    def acquire_batch_raw(self, analog_inputs=None, analog_outputs=None, input_range={}):
+        raise NotImplementedError('Batch acquisition is not implemented for spatial models')
 
 
 class AxonalInitiationModel(SpatialBrianExperiment):
@@ -0,0 +1,222 @@
+'''
+Linear models of RC circuits, computed exactly without Brian.
+
+Commands are constant over each sampling step, so the model is discretized exactly (zero-order hold)
+and responses are computed with linear filters, for all trials at once.
+Values are in SI units (volt, amp, ohm, farad, second).
+'''
+import numpy as np
+from scipy.linalg import expm
+from scipy.signal import lfilter
+from clampy.devices import Board
+
+__all__ = ['LinearModel', 'LinearRC', 'LinearRC_and_electrode']
+
+class LinearModel(Board):
+    '''
+    A linear model that can be recorded in current-clamp or voltage-clamp.
+
+    The model is defined by the matrices of dx/dt = A*x + B*[I, 1], where I is the injected current,
+    and model variables are linear functions of x.
+    The injected current is I = Ic + Iclamp, with Iclamp = gclamp*(Vc - V) (gclamp = 0 in current-clamp).
+    '''
+    def __init__(self, state_names, V0, gclamp = 10e-6, dt = 0.1e-3):
+        '''
+        Parameters
+        ----------
+        state_names : names of the state variables, including V (membrane potential)
+        V0 : initial value of state variables
+        gclamp : gain of the voltage-clamp
+        dt : sampling step
+        '''
+        Board.__init__(self)
+        self.state_names = state_names
+        self.x = np.ones(len(state_names)) * V0
+        self.dt = dt
+        self.sampling_rate = 1./dt
+        self.gclamp = gclamp
+        self.discretized = dict() # maps gclamp to the discretized system
+        self.discretized_system = None # system and sampling step of the discretizations
+        self.configure_board()
+        self.is_voltage_clamp = False # Initially in current clamp
+
+    def configure_board(self):
+        # Expose all variables
+        for name in list(self.variables().keys()) + ['I', 'Iclamp']:
+            self.set_analog_input(name, name, gain=1.)
+        self.set_analog_output('Vc', 'Vc', gain=1.)
+        self.set_analog_output('Ic', 'Ic', gain=1.)
+
+    def current_clamp(self, channel=None):
+        self.is_voltage_clamp = False
+
+    def voltage_clamp(self, channel=None):
+        self.is_voltage_clamp = True
+
+    def system(self):
+        '''
+        Returns A (n x n) and B (n x 2), such that dx/dt = A*x + B*[I, 1].
+        '''
+        raise NotImplementedError
+
+    def variables(self):
+        '''
+        Returns a dictionary mapping each variable name to a vector c, such that the variable is c*x.
+        '''
+        raise NotImplementedError
+
+    def discretize(self, g):
+        '''
+        Returns the discretized system with clamp conductance g, in modal form:
+        eigenvalues L, eigenvector matrix P and its inverse Pinv, and input matrix Bd,
+        such that z = Pinv*x follows z[k+1] = L*z[k] + Pinv*Bd*[Ic[k], Vc[k], 1].
+        Discretizations are cached, until the parameters or the sampling step change.
+        '''
+        A, B = self.system()
+        key = (self.dt, A.tobytes(), B.tobytes())
+        if key != self.discretized_system: # parameters changed
+            self.discretized = dict()
+            self.discretized_system = key
+        if g not in self.discretized:
+            n = len(A)
+            iV = self.state_names.index('V')
+            # Inputs Ic, Vc and constant: I = Ic + g*Vc - g*V
+            Ac = A.copy()
+            Ac[:, iV] -= g * B[:, 0]
+            Bc = np.column_stack([B[:, 0], g * B[:, 0], B[:, 1]])
+            # Exact zero-order hold discretization
+            M = np.zeros((n + 3, n + 3))
+            M[:n, :n] = Ac
+            M[:n, n:] = Bc
+            E = expm(M * self.dt)
+            Ad, Bd = E[:n, :n], E[:n, n:]
+            L, P = np.linalg.eig(Ad)
+            self.discretized[g] = (L, P, np.linalg.inv(P), Bd)
+        return self.discretized[g]
+
+    def simulate(self, x0, Ic, Vc, g):
+        '''
+        Simulates trials from initial state x0.
+
+        Parameters
+        ----------
+        x0 : initial state (n)
+        Ic, Vc : commands (trials x samples)
+        g : clamp conductance
+
+        Returns
+        -------
+        State (trials x n x samples) and final state (trials x n).
+        '''
+        L, P, Pinv, Bd = self.discretize(g)
+        ntrials, nsamples = Ic.shape
+        # Modal inputs: trials x n x samples
+        W = np.einsum('ij,jk,tkl->til', Pinv, Bd[:, :2], np.array([Ic, Vc]).transpose(1, 0, 2))
+        W += np.dot(Pinv, Bd[:, 2])[None, :, None]
+        z0 = np.dot(Pinv, x0)
+        Z = np.zeros((ntrials, len(L), nsamples + 1), dtype=complex)
+        Z[:, :, 0] = z0
+        for i, l in enumerate(L):
+            # z[k+1] = l*z[k] + w[k]
+            Z[:, i, 1:] = lfilter([1.], [1., -l], W[:, i, :], axis=-1, zi=np.ones((ntrials, 1)) * l * z0[i])[0]
+        X = np.einsum('ij,tjk->tik', P, Z).real
+        return X[:, :, :-1], X[:, :, -1]
+
+    def outputs(self, names, X, Ic, Vc, g):
+        '''
+        Returns the named variables from state X (trials x n x samples).
+        '''
+        Iclamp = g * (Vc - X[:, self.state_names.index('V'), :])
+        variables = self.variables()
+        results = []
+        for name in names:
+            if name == 'I':
+                results.append(Ic + Iclamp)
+            elif name == 'Iclamp':
+                results.append(Iclamp)
+            else:
+                results.append(np.einsum('i,tik->tk', np.array(variables[name], dtype=float), X))
+        return results
+
+    def commands(self, analog_outputs):
+        '''
+        Returns Ic, Vc and g from the commands, switching the clamp mode automatically.
+        '''
+        if ('Vc' in analog_outputs) and not ('Ic' in analog_outputs):
+            self.voltage_clamp()
+        elif ('Ic' in analog_outputs) and not ('Vc' in analog_outputs):
+            self.current_clamp()
+        shape = np.shape(list(analog_outputs.values())[0])
+        Ic = np.asarray(analog_outputs['Ic'], dtype=float) if 'Ic' in analog_outputs else np.zeros(shape)
+        Vc = np.asarray(analog_outputs['Vc'], dtype=float) if 'Vc' in analog_outputs else np.zeros(shape)
+        return Ic, Vc, self.gclamp * self.is_voltage_clamp
+
+    def acquire_raw(self, analog_inputs=None, analog_outputs=None, digital_inputs=None, digital_outputs=None, input_range={}):
+        '''
+        Send commands and acquire signals.
+
+        Parameters
+        ----------
+        analog_inputs
+            A list of input variables to acquire.
+        analog_outputs
+            A dictionary of commands.
+        '''
+        Ic, Vc, g = self.commands(analog_outputs)
+        Ic, Vc = Ic[None, :], Vc[None, :]
+        X, x = self.simulate(self.x, Ic, Vc, g)
+        self.x = x[0]
+        return [value[0] for value in self.outputs(analog_inputs, X, Ic, Vc, g)]
+
+    def acquire_batch_raw(self, analog_inputs=None, analog_outputs=None, input_range={}):
+        '''
+        Simulates all trials at once, starting from the current state of the model.
+        The state of the model is not changed.
+        '''
+        Ic, Vc, g = self.commands(analog_outputs)
+        X, _ = self.simulate(self.x, Ic, Vc, g)
+        return self.outputs(analog_inputs, X, Ic, Vc, g)
+
+class LinearRC(LinearModel):
+    '''
+    An RC model with parameters similar to Paramecium passive properties (see `RC`).
+    '''
+    def __init__(self, R = 65e6, C = 700e-12, V0 = -30e-3, dt = 0.1e-3, gclamp = 10e-6):
+        self.R, self.C, self.V0 = R, C, V0
+        LinearModel.__init__(self, ['V'], V0, gclamp, dt)
+
+    def system(self):
+        # dV/dt = (I-(V-V0)/R)/C
+        A = np.array([[-1./(self.R*self.C)]])
+        B = np.array([[1./self.C, self.V0/(self.R*self.C)]])
+        return A, B
+
+    def variables(self):
+        return {'V': [1.]}
+
+class LinearRC_and_electrode(LinearModel):
+    '''
+    A model consisting of an RC cell together with an electrode model (see `RC_and_electrode`).
+    '''
+    def __init__(self, R = 65e6, C = 700e-12, V0 = -30e-3, Re = 50e6, Ce = 10e-12,
+                 dt = 0.1e-3, gclamp = 10e-6):
+        self.R, self.C, self.V0, self.Re, self.Ce = R, C, V0, Re, Ce
+        LinearModel.__init__(self, ['Vm', 'V'], V0, gclamp, dt)
+
+    def system(self):
+        # dVm/dt = (Ie-(Vm-V0)/R)/C
+        # dV/dt = (I-Ie)/Ce
+        # Ie = (V-Vm)/Re
+        R, C, V0, Re, Ce = self.R, self.C, self.V0, self.Re, self.Ce
+        A = np.array([[-1./(Re*C) - 1./(R*C), 1./(Re*C)],
+                      [1./(Re*Ce), -1./(Re*Ce)]])
+        B = np.array([[0., V0/(R*C)],
+                      [1./Ce, 0.]])
+        return A, B
+
+    def variables(self):
+        Re = self.Re
+        return {'Vm': [1., 0.],
+                'V': [0., 1.],
+                'V2': [1., 0.],
+                'Ie': [-1./Re, 1./Re]}
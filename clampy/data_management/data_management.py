@@ -2,7 +2,6 @@
 Data management tools
 '''
 from future.utils import iteritems
-import collections
 import os
 import textwrap
 from datetime import datetime
@@ -10,6 +9,12 @@ import inspect
 import warnings
 import io
 import shutil
+import struct
+import zipfile
+try:
+    from collections.abc import Mapping
+except ImportError: # Python 2
+    from collections import Mapping
 
 try:
     import json
@@ -24,11 +29,19 @@ import gzip
 import numpy as np
 import sys
 import re
-import uuid
+import hashlib
+import tempfile
+import threading
+from functools import partial
+from multiprocessing import Pool
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
 
 __all__ = ['date_time', 'save_info', 'current_script', 'save_current_script',
            'current_filename', 'SessionRecorder', 'load_info', 'load_data',
-           'print_and_log', 'load_dataset']
+           'print_and_log', 'load_dataset', 'Dataset', 'ChunkedWriter', 'DataCache', 'set_data_cache']
 
 def print_and_log(filename, s):
     '''
@@ -45,24 +58,29 @@ def date_time():
     t = datetime.now()
     return '{}.{}.{} {}.{}.{}'.format(t.day, t.month, t.year, t.hour, t.minute, t.second)
 
-def load_dataset(filename, copy_first=False, first_only=False):
+def load_dataset(filename, copy_first=False, first_only=False, lazy=False, workers=1, cache=None):
     '''
-    Loads a set of data files, of the form filename???.txt or .txt.gz or .npz
+    Loads a set of data files, of the form filename???.txt or .txt.gz or .npz or .npy
+    (only .npy files written by `ChunkedWriter`, i.e., with one field per signal).
     If t is a variable, it is assumed to be identical in all trials (possibly with different durations).
     Assuming numbering from 0 to n, or no number at all.
     If first_only is True, loads only the first trial.
 
     Returns a dictionary of signals, each signal being a matrix (row = trial, column = time).
     Trials are trimmed to the minimum duration over trials.
+    If lazy is True, returns a `Dataset`, which loads signals only when they are accessed.
+    Files that cannot be memory-mapped (text, compressed .npz) are loaded by `workers` processes in parallel
+    (None: number of CPUs).
+    Text files are converted to binary format in the cache (see `load_data`).
     '''
     folder, name = os.path.split(filename)
-    pattern = re.compile(name+r'(\d*)\.(txt|txt\.gz|npz)$')
+    pattern = re.compile(name+r'(\d*)\.(txt|txt\.gz|npz|npy)$')
 
     # Sort trials
     files = []
     for f in os.listdir(folder):
         result = pattern.match(os.path.split(f)[1])
-        if result is not None:
+        if (result is not None) and (result.group(2) != 'npy' or _is_signal_npy(os.path.join(folder,f))):
             if result.group(1) == '':
                 n = 0
             else:
@@ -75,32 +93,233 @@ def load_dataset(filename, copy_first=False, first_only=False):
     if len(files)==0:
         return None
 
-    # Load files
-    all_signals = {}
-    min_size = 1e20
-    i = 0
-    for _, file in files:
-        signals = load_data(file, copy_first=copy_first)
-        if len(signals[list(signals.keys())[0]])<min_size:
-            min_size = len(signals[list(signals.keys())[0]])
-        if i == 0:
-            all_signals = {x : [y] for x,y in signals.items() if (x is not 't') and (len(y.shape)>0)} # remove scalars
+    dataset = Dataset([file for _, file in files], copy_first=copy_first, workers=workers, cache=cache)
+    if lazy:
+        return dataset
+    else:
+        return {name: dataset[name] for name in dataset}
+
+def _is_signal_npy(filename):
+    '''
+    Returns True if a .npy file holds a structured array (one field per signal), as written by `ChunkedWriter`.
+    '''
+    with open(filename, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            _, _, dtype = np.lib.format.read_array_header_1_0(f)
         else:
-            all_signals = {x : all_signals[x]+[y] for x,y in signals.items() if (x is not 't') and (len(y.shape)>0)}
-        i += 1
+            _, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return dtype.names is not None
 
-    # Cut at minimum size (trials could have different sizes)
-    if 't' in signals:
-        all_signals['t'] = signals['t'][:min_size]
-    for key in all_signals:
-        if (key != 't'):
-            all_signals[key] = [signal[:min_size] for signal in all_signals[key]]
+def _npz_index(filename):
+    '''
+    Reads the headers of the arrays stored in a .npz file.
+    Returns a dictionary mapping names to the shape, dtype, order and position of the data in the file
+    (None if the array is compressed).
+    '''
+    index = dict()
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as raw:
+        for info in archive.infolist():
+            if not info.filename.endswith('.npy'):
+                continue
+            with archive.open(info) as f:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                header_size = f.tell()
+            if (info.compress_type == zipfile.ZIP_STORED) and not dtype.hasobject:
+                # Data follow the local file header of the member
+                raw.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack('<HH', raw.read(4))
+                offset = info.header_offset + 30 + name_length + extra_length + header_size
+            else:
+                offset = None
+            index[info.filename[:-4]] = (shape, dtype, 'F' if fortran_order else 'C', offset)
+    return index
+
+class Dataset(Mapping):
+    '''
+    A set of trials, with signals loaded on demand (returned by `load_dataset` with lazy=True).
+
+    Signals are obtained as trials x time matrices, trimmed to the minimum duration over trials,
+    with dataset[name] or dataset.read(name, trials, start, stop) for a slice.
+    Files are read only when needed: .npy files and uncompressed .npz files are memory-mapped,
+    compressed .npz files are decompressed signal by signal, and text files are loaded once.
+    With several workers, files that are not memory-mapped are loaded in parallel by a pool of processes
+    and kept in memory.
+    '''
+    def __init__(self, files, copy_first=False, workers=1, cache=None):
+        '''
+        Parameters
+        ----------
+        files : list of file names, one per trial
+        copy_first : if True, files are read at once in memory before being parsed
+        workers : number of processes used to load files (None: number of CPUs)
+        cache : `DataCache` for text files (default: the one set with `set_data_cache`)
+        '''
+        self.files = list(files)
+        self.copy_first = copy_first
+        self.workers = workers
+        if cache is None:
+            cache = _data_cache
+        self.cache = cache
+        self.ntrials = len(self.files)
+        self.loaded = dict() # trials loaded in memory (text files)
+        self.indexes = dict() # headers of .npz files
+        self._lengths = None
+        self.names = [name for name, shape in self.shapes(0).items() if (name != 't') and (len(shape) > 0)] # remove scalars
+        if 't' in self.shapes(0):
+            self.names.append('t')
+
+    def shapes(self, trial):
+        '''
+        Returns the shapes of the signals of a trial, as a dictionary.
+        '''
+        filename = self.files[trial]
+        if filename.endswith('.npy') and not self.copy_first:
+            data = np.load(filename, mmap_mode='r')
+            return {name: data.shape for name in data.dtype.names}
+        elif filename.endswith('.npz') and not self.copy_first:
+            return {name: value[0] for name, value in self.npz_index(trial).items() if not value[1].hasobject}
+        else:
+            return {name: np.shape(value) for name, value in self.load(trial).items()}
+
+    def load(self, trial):
+        '''
+        Returns the signals of a trial, as a dictionary of arrays.
+        '''
+        if trial in self.loaded:
+            return self.loaded[trial]
+        filename = self.files[trial]
+        if filename.endswith('.npz') and not self.copy_first:
+            return _NpzSignals(filename, self.npz_index(trial))
+        signals = load_data(filename, copy_first=self.copy_first, cache=self.cache)
+        if not filename.endswith('.npy') or self.copy_first:
+            self.loaded[trial] = signals
+        return signals
+
+    def mapped(self, trial):
+        '''
+        Returns True if the signals of a trial are memory-mapped.
+        '''
+        filename = self.files[trial]
+        if self.copy_first:
+            return False
+        elif filename.endswith('.npy'):
+            return True
+        elif filename.endswith('.npz'):
+            return all(offset is not None for shape, dtype, _, offset in self.npz_index(trial).values()
+                       if len(shape) > 0)
+        else:
+            return False
+
+    def preload(self, trials=None):
+        '''
+        Loads in memory the trials that are not memory-mapped, in parallel if there are several workers.
+        '''
+        if trials is None:
+            trials = range(self.ntrials)
+        trials = [trial for trial in trials if (trial not in self.loaded) and not self.mapped(trial)]
+        if (self.workers == 1) or (len(trials) < 2):
+            return
+        pool = Pool(self.workers)
+        try:
+            signals = pool.map(partial(_load_trial, copy_first=self.copy_first, cache=self.cache),
+                               [self.files[trial] for trial in trials])
+        finally:
+            pool.close()
+            pool.join()
+        self.loaded.update(zip(trials, signals))
+
+    def npz_index(self, trial):
+        '''
+        Returns the index of a .npz file (see `_npz_index`), read once.
+        '''
+        if trial not in self.indexes:
+            self.indexes[trial] = _npz_index(self.files[trial])
+        return self.indexes[trial]
+
+    @property
+    def lengths(self):
+        '''
+        Number of samples of each trial.
+        '''
+        if self._lengths is None:
+            if not self.files[0].endswith('.npz'): # text files are loaded to find their length
+                self.preload()
+            name = self.names[0]
+            self._lengths = np.array([self.shapes(trial)[name][0] for trial in range(self.ntrials)])
+        return self._lengths
+
+    @property
+    def nsamples(self):
+        '''
+        Number of samples per trial (minimum over trials).
+        '''
+        return int(self.lengths.min())
+
+    def read(self, name, trials=None, start=0, stop=None):
+        '''
+        Returns a signal as a trials x time matrix (or a vector for the time `t`).
+
+        Parameters
+        ----------
+        name : name of the signal
+        trials : list or slice of trial indexes (default: all trials)
+        start, stop : time slice, in samples (default: all samples common to all trials)
+        '''
+        if name not in self.names:
+            raise KeyError(name)
+        if stop is None:
+            stop = self.nsamples
+        if name == 't':
+            return np.array(self.load(0)['t'][start:stop])
+        trials = np.arange(self.ntrials)[slice(None) if trials is None else trials]
+        self.preload(trials)
+        dtype = self.load(trials[0])[name].dtype if len(trials) > 0 else np.float64
+        M = np.empty((len(trials), stop - start), dtype=dtype)
+        for i, trial in enumerate(trials):
+            M[i] = self.load(trial)[name][start:stop]
+        return M
+
+    def __getitem__(self, name):
+        return self.read(name)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+class _NpzSignals(Mapping):
+    '''
+    Signals of a .npz file, each read when accessed.
+    Uncompressed arrays are memory-mapped.
+    Object arrays (e.g. acquisition_time=None) are skipped, since they would require pickle.
+    '''
+    def __init__(self, filename, index=None):
+        self.filename = filename
+        if index is None:
+            index = _npz_index(filename)
+        self.index = {name: value for name, value in index.items() if not value[1].hasobject}
 
-    # Turn to arrays
-    all_signals = {x: np.array(all_signals[x]) for x, y in all_signals.items()}
+    def __getitem__(self, name):
+        shape, dtype, order, offset = self.index[name]
+        if (offset is None) or (len(shape) == 0):
+            with np.load(self.filename) as f:
+                return np.array(f[name])
+        return np.memmap(self.filename, dtype=dtype, mode='r', offset=offset, shape=shape, order=order)
 
-    return all_signals
+    def __iter__(self):
+        return iter(self.index)
 
+    def __len__(self):
+        return len(self.index)
 
 def load_dataset_old(filename, copy_first=False, first_only=False):
     '''
@@ -165,47 +384,205 @@ def load_dataset_old(filename, copy_first=False, first_only=False):
     else:
         return None
 
-def load_data(filename, copy_first=False):
+class DataCache(object):
+    '''
+    A disk cache of text data files converted to binary format.
+
+    Signals of a text file are stored in a .npy file holding a structured array (as written by `ChunkedWriter`),
+    which is memory-mapped on later loads. Entries are identified by the path, modification time and size
+    of the text file, so that a modified file is converted again.
+    When the cache exceeds its maximum size, the least recently used entries are deleted.
+    The folder is created on the first write.
+    '''
+    def __init__(self, directory=None, max_size=10e9):
+        '''
+        Parameters
+        ----------
+        directory : cache folder (default: .clampy_cache in the home folder)
+        max_size : maximum total size of the cache, in bytes
+        '''
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.clampy_cache')
+        self.directory = directory
+        self.max_size = max_size
+
+    def entry(self, filename):
+        '''
+        Returns the name of the cache file for a data file.
+        '''
+        stat = os.stat(filename)
+        key = '{}|{}|{}'.format(os.path.abspath(filename), stat.st_mtime, stat.st_size)
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy')
+
+    def get(self, filename):
+        '''
+        Returns the signals of a data file as a dictionary of memory-mapped arrays, or None if not cached.
+        '''
+        entry = self.entry(filename)
+        try:
+            data = np.load(entry, mmap_mode='r')
+        except (IOError, ValueError): # not cached or incomplete
+            return None
+        os.utime(entry, None) # last use
+        return {name: data[name] for name in data.dtype.names}
+
+    def put(self, filename, signals):
+        '''
+        Stores the signals of a data file, then deletes old entries if the cache is too large.
+        '''
+        n = len(list(signals.values())[0])
+        data = np.zeros(n, dtype=[(name, np.float64) for name in signals])
+        for name, value in signals.items():
+            data[name] = value
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        # Written under a temporary name, so that entries are always complete
+        f, tmpname = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(f, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmpname, self.entry(filename))
+        self.evict()
+
+    def evict(self):
+        '''
+        Deletes the least recently used entries until the cache fits in its maximum size.
+        '''
+        if not os.path.exists(self.directory):
+            return
+        entries = []
+        for f in os.listdir(self.directory):
+            if f.endswith('.npy'):
+                stat = os.stat(os.path.join(self.directory, f))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.directory, f)))
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, f in entries[:-1]: # the most recent entry is kept
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(f)
+                size -= entry_size
+            except OSError: # already deleted, or in use
+                pass
+
+    def clear(self):
+        '''
+        Deletes all entries.
+        '''
+        if not os.path.exists(self.directory):
+            return
+        for f in os.listdir(self.directory):
+            if f.endswith('.npy'):
+                os.remove(os.path.join(self.directory, f))
+
+_data_cache = DataCache() # default cache of text files
+
+def set_data_cache(directory=None, max_size=10e9, enabled=True):
+    '''
+    Sets the cache used by default by `load_data` and `load_dataset` for text files (see `DataCache`).
+    If enabled is False, the cache is not used.
+    '''
+    global _data_cache
+    if enabled:
+        _data_cache = DataCache(directory, max_size)
+    else:
+        _data_cache = None
+
+def load_data(filename, copy_first=False, cache=None):
     '''
     Loads a data file, .npz, or .txt or .txt.gz, with the following conventions:
     - header gives variable names (separated by spaces)
     - one column = one variable
+    or .npy written by ChunkedWriter (memory-mapped).
     Returns a dictionary of signals
+
+    If copy_first is True, the file is first read in memory at once (e.g. for files on a network drive
+    or being written), then parsed from memory.
+    Text files are converted to binary format in the cache (a `DataCache`, by default the one set with
+    `set_data_cache`, in ~/.clampy_cache unless changed), and memory-mapped from there on later loads.
+    If the cache cannot be written (e.g. read-only folder), the file is loaded without caching.
     '''
     _, ext = os.path.splitext(filename)
 
-    if copy_first:
-        newfilename = str(uuid.uuid4())+ext
-        #shutil.copy(filename,newfilename)
-        os.system('cp "{}" "{}"'.format(filename,newfilename))
-        filename = newfilename
+    if ext == '.npy': # written by ChunkedWriter, memory-mapped
+        data = np.load(filename, mmap_mode='r')
+        if data.dtype.names is None:
+            raise IOError('File {} does not contain signals (structured array written by ChunkedWriter)'.format(filename))
+        return {name: data[name] for name in data.dtype.names}
+
+    if cache is None:
+        cache = _data_cache
+    if (cache is not None) and (ext != '.npz'):
+        signals = cache.get(filename)
+        if signals is not None:
+            return signals
+
+    if copy_first: # snapshot of the file in memory, read at once
+        with open(filename, 'rb') as f:
+            snapshot = io.BytesIO(f.read())
+    else:
+        snapshot = None
+
+    if ext == '.npz':
+        return np.load(filename if snapshot is None else snapshot)
+    variables, values = _read_text(filename, snapshot=snapshot)
+    signals = {name: value for name, value in zip(variables, values)}
 
-    # Get variable names
-    if ext == '.gz': # compressed
+    if cache is not None:
+        try:
+            cache.put(filename, signals)
+        except (IOError, OSError):
+            pass
+
+    return signals
+
+def _read_text(filename, block_size=2**24, snapshot=None):
+    '''
+    Reads a text file (possibly compressed) with a header line of variable names and one column per variable.
+    The text is parsed by blocks of about block_size characters with np.fromstring,
+    which is much faster than np.loadtxt in older versions of numpy.
+    If snapshot is given, the file content is read from this binary file object instead of the file.
+    Returns the variable names and a matrix of values (row = variable).
+    '''
+    if snapshot is not None:
+        if filename.endswith('.gz'): # compressed
+            snapshot = gzip.GzipFile(fileobj=snapshot, mode='rb')
+        f = io.TextIOWrapper(snapshot)
+    elif filename.endswith('.gz'): # compressed
         if sys.version_info.major == 2: # Python 2
             f = gzip.open(filename, mode='r')
         else: # Python 3
             f = gzip.open(filename, mode='rt')
-    elif ext == '.npz':
-        return np.load(filename)
-    else: # assuming text
-        f = open(filename, 'r')
-    variables = f.readline().split()
-    f.close()
-
-    # Load signals
-    if len(variables) == 1:
-        signals = { variables[0]: np.loadtxt(filename, skiprows=1, unpack=True)}
     else:
-        signals = {}
-        for name, value in zip(variables, np.loadtxt(filename, skiprows=1, unpack=True)):
-            signals[name] = value
-
-    # Clean up
-    if copy_first:
-        os.remove(newfilename)
-
-    return signals
+        f = open(filename, 'r')
+    with f:
+        variables = f.readline().split()
+        blocks = []
+        text = f.read(block_size)
+        while text:
+            text += f.readline() # complete the last line
+            # fromstring stops at the first value it cannot parse, with a DeprecationWarning
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', DeprecationWarning)
+                try:
+                    blocks.append(np.fromstring(text, sep=' '))
+                except DeprecationWarning:
+                    raise IOError('File {} could not be parsed'.format(filename))
+            text = f.read(block_size)
+    values = np.concatenate(blocks) if len(blocks) > 0 else np.zeros(0)
+    if len(values) % len(variables) != 0:
+        raise IOError('File {} could not be parsed'.format(filename))
+    return variables, values.reshape(-1, len(variables)).T
+
+def _load_trial(filename, copy_first=False, cache=None):
+    '''
+    Loads all signals of a file in memory (scalars of .npz files excepted).
+    '''
+    if filename.endswith('.npz') and not copy_first:
+        signals = _NpzSignals(filename)
+        return {name: np.array(signals[name]) for name, (shape, dtype, _, _) in signals.index.items()
+                if not dtype.hasobject}
+    return dict(load_data(filename, copy_first=copy_first, cache=cache))
 
 def save_info(filename, **parameters):
     '''
@@ -291,25 +668,82 @@ def save_current_script(filename = None, path = ''):
 def current_filename():
     return inspect.getfile(inspect.getmodule(inspect.currentframe(1)))
 
+class _RowBuffer(object):
+    '''
+    A growable array with a fixed number of columns.
+    Rows are written in a preallocated array, whose capacity is doubled when it is full.
+    '''
+    def __init__(self, ncolumns, capacity=1024):
+        self.buffer = np.zeros((capacity, ncolumns))
+        self.size = 0
+
+    def extend(self, n):
+        '''
+        Adds n rows and returns them (as a view), to be filled by the caller.
+        '''
+        if self.size + n > len(self.buffer):
+            capacity = max(2 * len(self.buffer), self.size + n)
+            buffer = np.zeros((capacity, self.buffer.shape[1]))
+            buffer[:self.size] = self.buffer[:self.size]
+            self.buffer = buffer
+        self.size += n
+        return self.buffer[self.size - n:self.size]
+
+    @property
+    def data(self):
+        return self.buffer[:self.size]
+
 class SessionRecorder(object):
-    def __init__(self, basedir, dt):
+    '''
+    Records data during a session, for example in an oscilloscope, and saves them when recording stops.
+
+    Each call to `record` adds rows to the array of a name, with the sample number, the time and the values.
+    If flush_interval is given, rows are written to disk in the background while recording
+    (one .npy file per name, see `ChunkedWriter`), so that memory stays bounded and data are not lost
+    in a crash. The files are consolidated into a single .npz file when recording stops.
+    '''
+    def __init__(self, basedir, dt, flush_interval=None, chunk_size=10000):
+        '''
+        Parameters
+        ----------
+        basedir : folder where recordings are saved
+        dt : sampling step
+        flush_interval : maximum time between writes to disk, in second (None: data are kept in memory)
+        chunk_size : number of rows written at once
+        '''
         self.dt = float(dt)
         self.basedir = basedir
         if not os.path.exists(self.basedir):
             os.makedirs(self.basedir)
         self.start_time_real = None
         self.start_time_counter = None
-        self.recordings = collections.defaultdict(list)
+        self.recordings = dict() # name -> _RowBuffer
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+        self.writers = dict() # name -> ChunkedWriter
 
     def start_recording(self):
         self.start_time_real = datetime.now()
         self.start_time_counter = time.time()
+        self.writers = dict()
+
+    def basename(self):
+        return 'recording_' + self.start_time_real.strftime('%H:%M:%S')
+
+    def part_filename(self, name):
+        '''
+        Name of the file where rows of `name` are written while recording.
+        '''
+        return os.path.join(self.basedir, '{}_{}.npy'.format(self.basename(), name))
 
     def stop_recording(self):
-        formatted_time = self.start_time_real.strftime('%H:%M:%S')
-        basename = 'recording_' + formatted_time
-        dict_of_arrays = {name: np.array(list(zip(*values)))
-                          for name, values in self.recordings.items()}
+        basename = self.basename()
+        if self.flush_interval is None:
+            dict_of_arrays = {name: values.data for name, values in self.recordings.items()}
+        else:
+            for writer in self.writers.values():
+                writer.close()
+            dict_of_arrays = self.consolidate(list(self.writers.keys()))
         np.savez_compressed(os.path.join(self.basedir, basename + '.npz'),
                             **dict_of_arrays)
         with open(os.path.join(self.basedir, basename + '_info.txt'),
@@ -335,12 +769,191 @@ class SessionRecorder(object):
                 f.write('{}: {} x {}\n'.format(name,
                                                values.shape[0],
                                                values.shape[1]))
+        # The consolidated file is written, the parts can be deleted
+        for name in self.writers:
+            os.remove(self.part_filename(name))
+        self.writers = dict()
+
+    def consolidate(self, names):
+        '''
+        Reads the files written while recording, and returns a dictionary of arrays (row = data point).
+        Can be used to recover data after a crash (with start_time_real set to the start of the recording).
+        '''
+        dict_of_arrays = dict()
+        for name in names:
+            data = np.load(self.part_filename(name), mmap_mode='r')
+            dict_of_arrays[name] = np.column_stack([data[field] for field in data.dtype.names])
+        return dict_of_arrays
 
     def record(self, name, sample, sample_start, *value_args):
+        n = len(value_args[0])
+        time_points = (sample_start - self.start_time_counter) + np.arange(n) * self.dt
+        if self.flush_interval is not None: # written in the background
+            if name not in self.writers:
+                self.writers[name] = ChunkedWriter(self.part_filename(name),
+                                                   ['sample', 'time'] + ['value{}'.format(i) for i in range(len(value_args))],
+                                                   chunk_size=self.chunk_size, flush_interval=self.flush_interval)
+            self.writers[name].write([np.full(n, sample, dtype=np.float64), time_points] + list(value_args))
+            return
         if name not in self.recordings:
-            self.recordings[name] = [[] for _ in range(2 + len(value_args))]
-        time_points = (sample_start - self.start_time_counter) + np.arange(len(value_args[0])) * self.dt
-        self.recordings[name][0].extend([sample] * len(time_points))
-        self.recordings[name][1].extend(time_points)
+            self.recordings[name] = _RowBuffer(2 + len(value_args))
+        rows = self.recordings[name].extend(n)
+        rows[:, 0] = sample
+        rows[:, 1] = time_points
         for value_idx, values in enumerate(value_args):
-            self.recordings[name][2 + value_idx].extend(values)
+            rows[:, 2 + value_idx] = values
+
+    def record_seal_test(self, sample, sample_start, results, fields, name='seal_test'):
+        '''
+        Records the results of a seal test (e.g. `SealTest.analyze`) as one row.
+
+        Parameters
+        ----------
+        sample : sweep number
+        sample_start : time of the sweep
+        results : dictionary of results
+        fields : names of the results, in the order of the columns (e.g. `SealTest.fields`)
+        name : name of the recorded array
+        '''
+        self.record(name, sample, sample_start, *[[results[field]] for field in fields])
+
+class ChunkedWriter(object):
+    '''
+    Writes signals to disk while they are acquired, in a background thread.
+
+    Signals are appended by chunks of fixed size to a .npy file holding a structured array,
+    with one field per signal (plus the time `t` if the sampling rate is given), as saved by `Board.save`.
+    The header is updated after each chunk, so that the file is always readable and a crash
+    loses at most one chunk. If flush_interval is given, incomplete chunks are also written after this time.
+    The file can be opened with `load_data`, which memory-maps it,
+    so that any time segment can be read without loading the whole recording.
+
+    Example:
+
+        writer = ChunkedWriter('recording.npy', ['V1', 'V2'], sampling_rate=board.sampling_rate)
+        stream.add_callback(writer.write)
+        ...
+        writer.close()
+    '''
+    def __init__(self, filename, names, sampling_rate=None, chunk_size=100000, flush_interval=None):
+        '''
+        Parameters
+        ----------
+        filename : name of the file, with extension .npy
+        names : list of signal names
+        sampling_rate : sampling rate, used to add the time variable `t`
+        chunk_size : number of samples per chunk
+        flush_interval : maximum time before samples are written, in second (None: only full chunks are written)
+        '''
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.names = list(names)
+        self.sampling_rate = sampling_rate
+        fields = self.names
+        if sampling_rate is not None:
+            fields = fields + ['t']
+        self.dtype = np.dtype([(name, np.float64) for name in fields])
+        self.chunk = np.zeros(chunk_size, dtype=self.dtype)
+        self.nchunk = 0 # number of samples in the current chunk
+        self.nsamples = 0 # number of samples on disk
+
+        self.file = open(filename, 'wb')
+        # Header with enough room for any number of samples
+        header = self.header()
+        self.header_size = 64*((len(header) + 10 + 20) // 64 + 1)
+        self.write_header()
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def header(self):
+        return "{{'descr': {}, 'fortran_order': False, 'shape': ({},), }}".format(
+            np.lib.format.dtype_to_descr(self.dtype), self.nsamples)
+
+    def write_header(self):
+        header = self.header().ljust(self.header_size - 11) + '\n'
+        self.file.seek(0)
+        self.file.write(b'\x93NUMPY\x01\x00' + np.array(len(header), dtype='<u2').tobytes() + header.encode('latin1'))
+        self.file.seek(0, os.SEEK_END)
+
+    def write(self, signals):
+        '''
+        Queues a block of signals for writing.
+        signals is a dictionary of arrays, a list of arrays in the order of names,
+        or a single array if there is just one signal.
+        '''
+        if isinstance(signals, dict):
+            signals = [signals[name] for name in self.names]
+        elif len(self.names) == 1:
+            signals = [signals]
+        self.queue.put([np.array(signal, dtype=np.float64) for signal in signals])
+
+    def run(self):
+        while True:
+            # Waits at most until the pending samples must be written
+            if (self.flush_interval is not None) and (self.nchunk > 0):
+                timeout = max(self.last_flush + self.flush_interval - time.time(), 0)
+            else:
+                timeout = self.flush_interval
+            try:
+                signals = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                signals = []
+            if signals is None:
+                break
+            self.append(signals)
+            if (self.flush_interval is not None) and (self.nchunk > 0) and \
+               (time.time() - self.last_flush >= self.flush_interval):
+                self.flush()
+
+    def append(self, signals):
+        '''
+        Adds a block of signals to the current chunk, writing full chunks.
+        '''
+        n = len(signals[0]) if len(signals) > 0 else 0
+        i = 0
+        while i < n:
+            k = min(n - i, len(self.chunk) - self.nchunk)
+            for name, signal in zip(self.names, signals):
+                self.chunk[name][self.nchunk:self.nchunk + k] = signal[i:i + k]
+            if self.sampling_rate is not None:
+                self.chunk['t'][self.nchunk:self.nchunk + k] = \
+                    np.arange(self.nsamples + self.nchunk, self.nsamples + self.nchunk + k) / self.sampling_rate
+            self.nchunk += k
+            i += k
+            if self.nchunk == len(self.chunk):
+                self.flush()
+
+    def flush(self):
+        '''
+        Writes the current chunk to disk and updates the header.
+        '''
+        self.file.write(self.chunk[:self.nchunk].tobytes())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.nsamples += self.nchunk
+        self.nchunk = 0
+        self.write_header()
+        self.file.flush()
+        self.last_flush = time.time()
+
+    def close(self):
+        '''
+        Writes the remaining samples and closes the file.
+        '''
+        if self.file.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        if self.nchunk > 0:
+            self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
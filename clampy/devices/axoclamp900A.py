@@ -26,6 +26,7 @@ TODO:
 """
 from __future__ import print_function
 import ctypes
+import functools
 import logging
 import numpy as np
 import os
@@ -184,14 +185,85 @@ def _identify_amplifier(model, serial):
         raise AssertionError('Unknown model')
 
 
+def cached(getter):
+    """
+    Decorator for getters of `AxoClamp900A` with signature (channel, mode=None).
+    Values are kept in the property cache, keyed by (getter name, channel, mode).
+    """
+    @functools.wraps(getter)
+    def wrapper(self, channel, mode=None):
+        if mode is None:
+            mode = self.current_mode[channel]
+        if not self.cache_enabled:
+            return getter(self, channel, mode)
+        key = (getter.__name__, channel, mode)
+        if key not in self.cache:
+            errors = self.error_count
+            value = getter(self, channel, mode)
+            if self.error_count != errors: # failed, don't cache
+                return value
+            self.cache[key] = value
+        return self.cache[key]
+    return wrapper
+
+
+def writes_through(getter_name):
+    """
+    Decorator for setters of `AxoClamp900A` with signature (value, channel, mode=None),
+    for properties that the amplifier takes exactly as given (switches and signal choices).
+    The cached value of the corresponding getter is updated, or invalidated if the setter failed.
+    """
+    def decorator(setter):
+        @functools.wraps(setter)
+        def wrapper(self, value, channel, mode=None):
+            if mode is None:
+                mode = self.current_mode[channel]
+            errors = self.error_count
+            result = setter(self, value, channel, mode)
+            key = (getter_name, channel, mode)
+            if self.error_count == errors:
+                self.cache[key] = value
+            else:
+                self.cache.pop(key, None)
+            return result
+        return wrapper
+    return decorator
+
+
+def invalidates(*getter_names):
+    """
+    Decorator for methods of `AxoClamp900A` that change properties in a way that cannot be predicted
+    (values rounded or clipped by the amplifier, automatic adjustments).
+    Cached values of the named getters are invalidated, for all channels and modes.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwds):
+            self.invalidate(*getter_names)
+            result = method(self, *args, **kwds)
+            self.invalidate(*getter_names)
+            return result
+        return wrapper
+    return decorator
+
+
 class AxoClamp900A(object):
     """
     Device representing an Axoclamp 900A amplifier, which has two channels.
+
+    Properties read from the amplifier are cached (keyed by property, channel and mode),
+    so that repeated reads do not call the driver. Setters keep the cache up to date.
+    Use `refresh()` to read the cached properties again from the amplifier
+    (e.g. if they were changed on the front panel), or `AxoClamp900A(cache=False)` to disable the cache.
     """
     dll_path = r'C:\Program Files (x86)\Molecular Devices\AxoClamp 900A Commander 1.2' # We need something more robust!
     #dll_path = r'C:\Program Files (x86)\Molecular Devices\AxoClamp 900A Commander' # We need something more robust!
 
-    def __init__(self, **kwds):
+    def __init__(self, cache=True, **kwds):
+        self.gain_listeners = [] # functions called when gains may have changed
+        self.cache_enabled = cache
+        self.cache = dict() # maps (getter name, channel, mode) to value
+        self.error_count = 0
         #self.dllHID = ctypes.WinDLL(os.path.join(AxoClamp900A.dll_path, 'AxHIDManager.dll'))
         self.dll = ctypes.WinDLL(os.path.join(AxoClamp900A.dll_path, 'AxoclampDriver.dll'))
         self.last_error = ctypes.c_uint(NO_ERROR)
@@ -239,6 +311,38 @@ class AxoClamp900A(object):
         for name, ID in zip(names, range(18)):
             board.set_virtual_input(name, channel=(scaled_output1, scaled_output2), deviceID=ID,
                                     select=self.set_scaled_output_signal)
+        self.add_gain_listener(board.invalidate_gains)
+
+    def add_gain_listener(self, listener):
+        '''
+        Registers a function called (without argument) whenever the gains may have changed,
+        i.e., when scaled outputs are rerouted, their gains are set, or the mode changes.
+        '''
+        self.gain_listeners.append(listener)
+
+    def notify_gain_change(self):
+        for listener in self.gain_listeners:
+            listener()
+
+    def invalidate(self, *getter_names):
+        '''
+        Removes the named properties from the cache (all properties if no name is given).
+        '''
+        if len(getter_names) == 0:
+            self.cache.clear()
+        else:
+            for key in [key for key in self.cache if key[0] in getter_names]:
+                del self.cache[key]
+
+    def refresh(self):
+        '''
+        Reads all cached properties again from the amplifier.
+        '''
+        keys = list(self.cache.keys())
+        self.cache.clear()
+        for getter_name, channel, mode in keys:
+            getattr(self, getter_name)(channel, mode)
+        self.notify_gain_change()
 
     def get_scaled_signal_gain(self, signal):
         '''
@@ -281,6 +385,7 @@ class AxoClamp900A(object):
             if ``True``, any error will give rise to an `IOError`.
         """
         if self.last_error.value != NO_ERROR:
+            self.error_count += 1
             self.dll.AXC_BuildErrorText(self.msg_handler,
                                         self.last_error,
                                         self.error_msg,
@@ -341,6 +446,8 @@ class AxoClamp900A(object):
         if not self.dll.AXC_Reset(self.msg_handler,
                                   ctypes.byref(self.last_error)):
             self.check_error()
+        self.cache.clear()
+        self.notify_gain_change()
 
     def set_cache_enable(self, enable):
         if not self.dll.AXC_SetCacheEnable(self.msg_handler,
@@ -445,6 +552,7 @@ class AxoClamp900A(object):
 
     # **** Headstage Functions ****
 
+    @writes_through('get_holding_enable')
     def switch_holding(self, enable, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -455,6 +563,7 @@ class AxoClamp900A(object):
                                              ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_holding_enable(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -467,6 +576,7 @@ class AxoClamp900A(object):
             self.check_error()
         return enable
 
+    @invalidates('get_holding_level')
     def set_holding(self, value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -477,6 +587,7 @@ class AxoClamp900A(object):
                                             ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_holding_level(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -489,6 +600,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_holding_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -556,6 +668,7 @@ class AxoClamp900A(object):
 
     # **** External Command Functions ****
 
+    @writes_through('get_external_command_enable')
     def set_external_command_enable(self, enable, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -566,6 +679,7 @@ class AxoClamp900A(object):
                                             ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_external_command_enable(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -578,6 +692,7 @@ class AxoClamp900A(object):
             self.check_error()
         return enable
 
+    @cached
     def get_external_command_sensitivity(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -593,6 +708,7 @@ class AxoClamp900A(object):
 
     # **** Test Signal Functions ****
 
+    @writes_through('get_test_signal_enable')
     def set_test_signal_enable(self, enable, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -603,6 +719,7 @@ class AxoClamp900A(object):
                                                 ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_test_signal_enable(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -615,6 +732,7 @@ class AxoClamp900A(object):
             self.check_error()
         return enable
 
+    @invalidates('get_test_signal_amplitude')
     def set_test_signal_amplitude(self, value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -625,6 +743,7 @@ class AxoClamp900A(object):
                                                    ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_test_signal_amplitude(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -637,6 +756,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_test_signal_amplitude_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -649,6 +769,7 @@ class AxoClamp900A(object):
             self.check_error()
         return data
 
+    @invalidates('get_test_signal_frequency')
     def set_test_signal_frequency(self, value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -659,6 +780,7 @@ class AxoClamp900A(object):
                                                    ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_test_signal_frequency(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -671,6 +793,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_test_signal_frequency_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -697,6 +820,7 @@ class AxoClamp900A(object):
                                   ctypes.byref(self.last_error)):
             self.check_error()
 
+    @invalidates('get_pulse_duration')
     def set_pulse_duration(self, value, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -707,6 +831,7 @@ class AxoClamp900A(object):
                                              ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_pulse_duration(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -719,6 +844,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_pulse_duration_table(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -733,6 +859,7 @@ class AxoClamp900A(object):
             self.check_error()
         return (table.value, bufsize)
 
+    @invalidates('get_pulse_amplitude')
     def set_pulse_amplitude(self, value, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -743,6 +870,7 @@ class AxoClamp900A(object):
                                              ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_pulse_amplitude(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -755,6 +883,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_pulse_amplitude_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -778,6 +907,7 @@ class AxoClamp900A(object):
                                  ctypes.byref(self.last_error)):
             self.check_error()
 
+    @invalidates('get_buzz_duration')
     def set_buzz_duration(self, value, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -788,6 +918,7 @@ class AxoClamp900A(object):
                                             ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_buzz_duration(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -800,6 +931,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_buzz_duration_table(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -817,6 +949,7 @@ class AxoClamp900A(object):
 
     # **** Pipette Offset Functions ****
 
+    @invalidates('get_pipette_offset')
     def auto_pipette_offset(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -826,6 +959,7 @@ class AxoClamp900A(object):
                                               ctypes.byref(self.last_error)):
             self.check_error()
 
+    @writes_through('get_pipette_offset_lock')
     def set_pipette_offset_lock(self, enable, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -836,6 +970,7 @@ class AxoClamp900A(object):
                                                  ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_pipette_offset_lock(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -848,6 +983,7 @@ class AxoClamp900A(object):
             self.check_error()
         return enable
 
+    @invalidates('get_pipette_offset')
     def set_pipette_offset(self, value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -858,6 +994,7 @@ class AxoClamp900A(object):
                                              ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_pipette_offset(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -870,6 +1007,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_pipette_offset_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -899,6 +1037,7 @@ class AxoClamp900A(object):
 
     # **** Track Functions ****
 
+    @writes_through('get_track_enable')
     def set_track_enable(self, enable, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -909,6 +1048,7 @@ class AxoClamp900A(object):
                                            ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_track_enable(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -921,6 +1061,7 @@ class AxoClamp900A(object):
             self.check_error()
         return enable
 
+    @invalidates('get_track_level')
     def set_track_level(self, value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -931,6 +1072,7 @@ class AxoClamp900A(object):
                                           ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_track_level(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -943,6 +1085,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_track_level_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -955,6 +1098,7 @@ class AxoClamp900A(object):
             self.check_error()
         return data
 
+    @invalidates('get_track_speed')
     def set_track_speed(self, value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -965,6 +1109,7 @@ class AxoClamp900A(object):
                                           ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_track_speed(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -977,6 +1122,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_track_speed_table(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -994,6 +1140,7 @@ class AxoClamp900A(object):
 
     # **** Sample Rate Functions ****
 
+    @invalidates('get_sample_period')
     def set_sample_period(self, value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1004,6 +1151,7 @@ class AxoClamp900A(object):
                                             ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_sample_period(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1016,6 +1164,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_sample_period_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1031,6 +1180,7 @@ class AxoClamp900A(object):
 
     # **** Gain and Lag Functions ****
 
+    @invalidates('get_loop_gain', 'get_bridge_resistance')
     def set_loop_gain(self, value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1066,6 +1216,7 @@ class AxoClamp900A(object):
                 self.check_error()
             return value.value
 
+    @cached
     def get_loop_gain(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1078,6 +1229,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_loop_gain_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1091,6 +1243,7 @@ class AxoClamp900A(object):
         return data
 
 
+    @invalidates('get_loop_lag')
     def set_loop_lag(self, value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1101,6 +1254,7 @@ class AxoClamp900A(object):
                                        ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_loop_lag(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1113,6 +1267,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_loop_lag_table(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1128,6 +1283,7 @@ class AxoClamp900A(object):
         #return (table, bufsize)
         return table
 
+    @writes_through('get_dc_restore_enable')
     def set_dc_restore_enable(self, enable, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1138,6 +1294,7 @@ class AxoClamp900A(object):
                                                ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_dc_restore_enable(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1153,6 +1310,7 @@ class AxoClamp900A(object):
 
     # **** Pipette Capacitance Neutralization Functions ****
 
+    @writes_through('get_cap_neut_enable')
     def set_cap_neut_enable(self, enable, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1163,6 +1321,7 @@ class AxoClamp900A(object):
                                              ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_cap_neut_enable(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1175,6 +1334,7 @@ class AxoClamp900A(object):
             self.check_error()
         return enable
 
+    @invalidates('get_cap_neut_level')
     def set_cap_neut_level(self, value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1192,6 +1352,7 @@ class AxoClamp900A(object):
                                             ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_cap_neut_level(self, channel, mode=None):
         # Apparently this is not read from the amplifier, but rather a memory of previous commands (?!)
         if mode is None:
@@ -1205,6 +1366,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_cap_neut_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1220,6 +1382,7 @@ class AxoClamp900A(object):
 
     # **** oscillation Killer Functions ****
 
+    @writes_through('get_osc_killer_enable')
     def set_osc_killer_enable(self, enable, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1230,6 +1393,7 @@ class AxoClamp900A(object):
                                                ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_osc_killer_enable(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1242,6 +1406,7 @@ class AxoClamp900A(object):
             self.check_error()
         return enable
 
+    @writes_through('get_osc_killer_method')
     def set_osc_killer_method(self, method, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1252,6 +1417,7 @@ class AxoClamp900A(object):
                                                ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_osc_killer_method(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1268,6 +1434,7 @@ class AxoClamp900A(object):
     # **** Bridge Balance Functions ****
 
     # This one doesn't work: sets the resistance to 0
+    @invalidates('get_bridge_resistance')
     def auto_bridge_balance(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1284,6 +1451,7 @@ class AxoClamp900A(object):
         return self.get_bridge_resistance(channel)
 
     ## This only enables bridge balance and capa comp
+    @writes_through('get_bridge_enable')
     def set_bridge_enable(self, enable, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1299,6 +1467,7 @@ class AxoClamp900A(object):
                                             ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_bridge_enable(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1311,6 +1480,7 @@ class AxoClamp900A(object):
             self.check_error()
         return enable
 
+    @writes_through('get_bridge_lock')
     def set_bridge_lock(self, enable, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1321,6 +1491,7 @@ class AxoClamp900A(object):
                                           ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_bridge_lock(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1333,6 +1504,7 @@ class AxoClamp900A(object):
             self.check_error()
         return enable
 
+    @invalidates('get_bridge_resistance')
     def set_bridge_resistance(self, value, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1355,6 +1527,7 @@ class AxoClamp900A(object):
                                            ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_bridge_resistance(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1367,6 +1540,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_bridge_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1389,13 +1563,21 @@ class AxoClamp900A(object):
             channel = 1
         if mode is None:
             mode = self.current_mode[channel]
+        key = ('get_scaled_output_signal', channel, mode)
+        if self.cache_enabled and self.cache.get(key) == signal: # already routed
+            return
         if not self.dll.AXC_SetScaledOutputSignal(self.msg_handler,
                                                   ctypes.c_uint(signal),
                                                   ctypes.c_uint(channel),
                                                   ctypes.c_uint(mode),
                                                   ctypes.byref(self.last_error)):
             self.check_error()
+            self.cache.pop(key, None)
+        else:
+            self.cache[key] = signal
+        self.notify_gain_change()
 
+    @cached
     def get_scaled_output_signal(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1410,6 +1592,7 @@ class AxoClamp900A(object):
 
     # Gains are relative to the standard gain (1 to 1000)
     # There are only a restricted number of allowed gains, the amplifier rounds up automatically
+    @invalidates('get_scaled_output_signal_gain')
     def set_scaled_output_signal_gain(self, gain, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1419,7 +1602,9 @@ class AxoClamp900A(object):
                                                 ctypes.c_uint(mode),
                                                 ctypes.byref(self.last_error)):
             self.check_error()
+        self.notify_gain_change()
 
+    @cached
     def get_scaled_output_signal_gain(self, channel, mode=None):
         gain = ctypes.c_double(0.)
         if mode is None:
@@ -1432,6 +1617,7 @@ class AxoClamp900A(object):
             self.check_error()
         return gain.value
 
+    @cached
     def get_scaled_output_signal_gain_table(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1446,6 +1632,7 @@ class AxoClamp900A(object):
             self.check_error()
         return (table.value, bufsize)
 
+    @writes_through('get_scaled_output_LPF_type')
     def set_scaled_output_LPFT_type(self, type, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1456,6 +1643,7 @@ class AxoClamp900A(object):
                                                    ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_scaled_output_LPF_type(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1468,6 +1656,7 @@ class AxoClamp900A(object):
             self.check_error()
         return type
 
+    @invalidates('get_scaled_output_LPF')
     def set_scaled_output_LPF(self, lpf_value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1478,6 +1667,7 @@ class AxoClamp900A(object):
                                                ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_scaled_output_LPF(self, channel, mode=None):
         lpf_value = ctypes.c_double(0.)
         if mode is None:
@@ -1490,6 +1680,7 @@ class AxoClamp900A(object):
             self.check_error()
         return lpf_value.value
 
+    @cached
     def get_scaled_output_LPF_table(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1504,6 +1695,7 @@ class AxoClamp900A(object):
             self.check_error()
         return (table.value, bufsize)
 
+    @invalidates('get_scaled_output_HPF')
     def set_scaled_output_HPF(self, hpf_value, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1514,6 +1706,7 @@ class AxoClamp900A(object):
                                                ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_scaled_output_HPF(self, channel, mode=None):
         hpf_value = ctypes.c_double(0.)
         if mode is None:
@@ -1526,6 +1719,7 @@ class AxoClamp900A(object):
             self.check_error()
         return hpf_value.value
 
+    @cached
     def get_scaled_output_HPF_table(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1540,6 +1734,7 @@ class AxoClamp900A(object):
             self.check_error()
         return (table.value, bufsize)
 
+    @invalidates('get_scaled_output_zero_offset_level')
     def auto_scaled_output_zero_offset(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1549,6 +1744,7 @@ class AxoClamp900A(object):
                                                  ctypes.byref(self.last_error)):
             self.check_error()
 
+    @writes_through('get_scaled_output_zero_offset_enable')
     def set_scaled_output_zero_offset_enable(self, enable, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1559,6 +1755,7 @@ class AxoClamp900A(object):
                                                       ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_scaled_output_zero_offset_enable(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1571,6 +1768,7 @@ class AxoClamp900A(object):
             self.check_error()
         return enable
 
+    @invalidates('get_scaled_output_zero_offset_level')
     def set_scaled_output_zero_offset_level(self, value, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1582,6 +1780,7 @@ class AxoClamp900A(object):
                                                      ctypes.byref(self.last_error)):
             self.check_error()
 
+    @cached
     def get_scaled_output_zero_offset_level(self, channel, mode = None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1594,6 +1793,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @cached
     def get_scaled_output_zero_offset_range(self, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1652,6 +1852,8 @@ class AxoClamp900A(object):
                                            ctypes.c_bool(use_file),
                                            ctypes.byref(self.last_error)):
             self.check_error(fail = True)
+        self.cache.clear()
+        self.notify_gain_change()
 
     # **** Modes ****
 
@@ -1662,6 +1864,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_ICLAMP),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.notify_gain_change()
         self.set_external_command_enable(True, channel)
 
     def DCC(self):
@@ -1672,6 +1875,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_DCC),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.notify_gain_change()
         self.set_external_command_enable(True, 0)
 
     def dSEVC(self):
@@ -1682,6 +1886,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_DSEVC),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.notify_gain_change()
         self.set_external_command_enable(True, 0)
 
     def HVIC(self):
@@ -1692,6 +1897,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_HVIC),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.notify_gain_change()
         self.set_external_command_enable(True, 1)
 
     def TEVC(self):
@@ -1703,6 +1909,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_TEVC),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.notify_gain_change()
         self.set_external_command_enable(True, 1)
 
     def I0(self, channel):
@@ -1713,6 +1920,7 @@ class AxoClamp900A(object):
                                     ctypes.c_uint(MODE_IZERO),
                                     ctypes.byref(self.last_error)):
             self.check_error()
+        self.notify_gain_change()
 
     def get_meter_value(self, channel):
         value = ctypes.c_double(0.)
@@ -1725,6 +1933,7 @@ class AxoClamp900A(object):
             self.check_error()
         return value.value
 
+    @writes_through('get_test_signal_enable')
     def switch_pulses(self, enable, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1735,6 +1944,7 @@ class AxoClamp900A(object):
                                                 ctypes.byref(self.last_error)):
             self.check_error()
 
+    @invalidates('get_pulse_amplitude')
     def set_pulses_amplitude(self, amplitude, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -1745,6 +1955,7 @@ class AxoClamp900A(object):
                                               ctypes.byref(self.last_error)):
             self.check_error()
 
+    @invalidates('get_test_signal_frequency')
     def set_pulses_frequency(self, frequency, channel, mode=None):
         if mode is None:
             mode = self.current_mode[channel]
@@ -14,6 +14,9 @@ import numpy as np
 import time
 import os
 import warnings
+from .stream import *
+from ..data_management.data_management import ChunkedWriter
+from ..signals.waveform import Waveform
 
 __all__ = ['Board']
 
@@ -35,6 +38,9 @@ class Board:
         self.select_function = dict() # signal selection function for virtual channels
         self.alias = dict() # dictionary of aliases (mapping from alias to channel name)
         self.sampling_rate = None # could be a property
+        self.cache_gains = False # if True, gains obtained from devices are kept between acquisitions
+        self.output_buffers = dict() # channel -> array where Waveform commands are rendered
+        self.gain_cache = dict()
         self.reset_clock()
 
     def reset_clock(self):
@@ -174,8 +180,40 @@ class Board:
         deviceID = self.deviceID[name]
         if deviceID is None: # in this case the gain is a fixed number
             return self.gain[name]
+        elif self.cache_gains and (name in self.gain_cache):
+            return self.gain_cache[name]
         else: # call the device to get the gain
-            return self.gain[name](deviceID) # for virtual channels however, it should probably be the ID of the physical channel
+            gain = self.gain[name](deviceID) # for virtual channels however, it should probably be the ID of the physical channel
+            if self.cache_gains:
+                self.gain_cache[name] = gain
+            return gain
+
+    def output_buffer(self, channel, nsamples):
+        '''
+        Returns an array of nsamples for an analog output channel, reused between acquisitions.
+        '''
+        if (channel not in self.output_buffers) or (len(self.output_buffers[channel]) != nsamples):
+            self.output_buffers[channel] = np.zeros(nsamples)
+        return self.output_buffers[channel]
+
+    def resolve_gains(self, names):
+        '''
+        Returns a dictionary of gains of the named channels (keys are names with aliases substituted),
+        calling the device once per channel.
+        '''
+        gain = dict()
+        for name in names:
+            name = self.get_alias(name)
+            if name not in gain:
+                gain[name] = self.get_gain(name)
+        return gain
+
+    def invalidate_gains(self, *args):
+        '''
+        Clears the gain cache. This is called by devices when their state changes
+        (arguments are ignored).
+        '''
+        self.gain_cache.clear()
 
     def save(self, filename, acquisition_time=None, **signals):
         '''
@@ -247,42 +285,18 @@ class Board:
         np.savez_compressed(f, **signals)
         f.close()
 
-    def acquire(self, *inputs, **kwd):
+    def allocate_inputs(self, inputs):
         '''
-        Acquires scaled signals and returns scaled measurements (with appropriate gains).
-        Also handles virtual channels.
+        Allocates physical channels to the inputs, selecting the signals of virtual channels on the device.
 
         Parameters
         ----------
-        inputs : list of input names (= measurements)
-        kwd : keywords, either an output signal (key = output channel name, value = array)
-              or one of the following keywords. If the value is None, it is ignored.
-
-        save : filename to save the data
+        inputs : list of input names
 
         Returns
         -------
-        Values of inputs, as list of arrays or single array (if just one input).
+        analog_inputs, digital_inputs : lists of physical input names
         '''
-        # Parse keywords
-        filename = None
-        analog_outputs={}
-        digital_outputs={}
-        for keyword,value in iteritems(kwd):
-            if keyword=='save':
-                filename=value
-            elif value is not None:
-                if self.get_alias(keyword) in self.analog_output:
-                    analog_outputs[keyword]=value
-                elif self.get_alias(keyword) in self.digital_output:
-                    digital_outputs[keyword]=value
-                else:
-                    raise AttributeError('{} is not an output channel'.format(keyword))
-
-        # Substitute aliases
-        digital_outputs=self.substitute_aliases(digital_outputs)
-
-        # 1. Configure virtual channels
         # a. Dictionary of allocated channels
         all_channels = list(self.analog_input.keys()) + list(self.analog_output.keys())
         allocated=dict.fromkeys(all_channels, False)
@@ -318,13 +332,48 @@ class Board:
                     raise AttributeError('{} is not an input'.format(I))
         # c. Virtual outputs (not considered yet)
 
-        # 2. Get the correct gains
-        gain = dict()
-        for I in analog_inputs:
-            gain[I] = self.get_gain(I)
-        for O in analog_outputs:
-            O = self.get_alias(O)
-            gain[O] = self.get_gain(O)
+        return analog_inputs, digital_inputs
+
+    def acquire(self, *inputs, **kwd):
+        '''
+        Acquires scaled signals and returns scaled measurements (with appropriate gains).
+        Also handles virtual channels.
+
+        Parameters
+        ----------
+        inputs : list of input names (= measurements)
+        kwd : keywords, either an output signal (key = output channel name, value = array)
+              or one of the following keywords. If the value is None, it is ignored.
+
+        save : filename to save the data
+
+        Returns
+        -------
+        Values of inputs, as list of arrays or single array (if just one input).
+        '''
+        # Parse keywords
+        filename = None
+        analog_outputs={}
+        digital_outputs={}
+        for keyword,value in iteritems(kwd):
+            if keyword=='save':
+                filename=value
+            elif value is not None:
+                if self.get_alias(keyword) in self.analog_output:
+                    analog_outputs[keyword]=value
+                elif self.get_alias(keyword) in self.digital_output:
+                    digital_outputs[keyword]=value
+                else:
+                    raise AttributeError('{} is not an output channel'.format(keyword))
+
+        # Substitute aliases
+        digital_outputs=self.substitute_aliases(digital_outputs)
+
+        # 1. Configure virtual channels
+        analog_inputs, digital_inputs = self.allocate_inputs(inputs)
+
+        # 2. Get the correct gains (once per channel)
+        gain = self.resolve_gains(analog_inputs + list(analog_outputs.keys()))
 
         # 3. Check that all output arrays have the same length
         nsamples = [len(output) for output in analog_outputs.values()]
@@ -336,13 +385,21 @@ class Board:
         names, values = analog_outputs.keys(), analog_outputs.values()
         for name, value in zip(names, values):
             aliased_name = self.get_alias(name)
-            gain = self.get_gain(name)
-            #analog_outputs[name] = value * gain
-            raw_analog_outputs[self.analog_output[aliased_name]] = value * gain
+            channel = self.analog_output[aliased_name]
+            if isinstance(value, Waveform) and (value.unit is None) and not hasattr(gain[aliased_name], 'dimensions'):
+                # rendered in place, without allocation
+                raw_analog_outputs[channel] = (value * gain[aliased_name]).render(out=self.output_buffer(channel, len(value)))
+            elif isinstance(value, Waveform): # with units (e.g. Brian models)
+                raw_analog_outputs[channel] = value.quantity() * gain[aliased_name]
+            else:
+                #analog_outputs[name] = value * gain
+                raw_analog_outputs[channel] = value * gain[aliased_name]
 
         raw_digital_outputs = dict()
         for name, value in iteritems(digital_outputs):
             aliased_name = self.get_alias(name)
+            if isinstance(value, Waveform):
+                value = value.render()
             raw_digital_outputs[self.digital_output[aliased_name]] = value
 
         # 5. Acquire
@@ -352,8 +409,7 @@ class Board:
         input_range = dict()
         for name in analog_inputs:
             if (self.min[name] is not None) and (self.max[name] is not None):
-                gain = self.get_gain(name)
-                input_range[self.analog_input[name]] = (self.min[name]*gain, self.max[name]*gain)
+                input_range[self.analog_input[name]] = (self.min[name]*gain[name], self.max[name]*gain[name])
         acquisition_time = time.time()-self.init_time
         results = self.acquire_raw(analog_inputs=input_channels, analog_outputs=raw_analog_outputs,
                                    digital_inputs=digital_input_channels,
@@ -371,7 +427,7 @@ class Board:
             if I in digital_inputs:
                 scaled_results.append(digital_results.pop(0))
             else:
-                scaled_results.append(analog_results.pop(0)/self.get_gain(analog_inputs_copy.pop(0)))
+                scaled_results.append(analog_results.pop(0)/gain[analog_inputs_copy.pop(0)])
 
         # 7. Save
         if filename is not None:
@@ -380,6 +436,9 @@ class Board:
                 signals[name] = value
             signals.update(analog_outputs)
             signals.update(digital_outputs)
+            for name, value in iteritems(signals):
+                if isinstance(value, Waveform):
+                    signals[name] = value.render()
             self.save(filename, acquisition_time=acquisition_time, **signals)
 
         # Return
@@ -388,6 +447,179 @@ class Board:
         else:
             return scaled_results
 
+    def acquire_batch(self, *inputs, **kwd):
+        '''
+        Acquires several trials with the same inputs and outputs.
+        Commands are 2D arrays (trials x samples); a 1D command is used for all trials.
+        On real boards, trials are acquired one after the other; models can simulate them all at once.
+
+        Example:
+
+            V = board.acquire_batch('V', Ic=amplitudes[:, None]*pulse)
+
+        Parameters
+        ----------
+        inputs : list of analog input names
+        kwd : analog output signals (key = output channel name, value = array)
+
+        Returns
+        -------
+        Values of inputs (trials x samples), as list of 2D arrays or single 2D array (if just one input).
+        '''
+        analog_outputs = dict()
+        for keyword,value in iteritems(kwd):
+            if self.get_alias(keyword) in self.analog_output:
+                analog_outputs[keyword]=value
+            else:
+                raise AttributeError('{} is not an analog output channel'.format(keyword))
+
+        if len(analog_outputs)==0:
+            raise ValueError('acquire_batch needs at least one analog output to define the trials')
+
+        analog_inputs, digital_inputs = self.allocate_inputs(inputs)
+        if len(digital_inputs)>0:
+            raise AttributeError('Digital inputs cannot be acquired in batch')
+
+        gain = self.resolve_gains(analog_inputs + list(analog_outputs.keys()))
+
+        # Broadcast commands to trials x samples
+        ntrials = max([1] + [len(value) for value in analog_outputs.values() if np.ndim(value) == 2])
+        raw_analog_outputs = dict()
+        for name, value in iteritems(analog_outputs):
+            if isinstance(value, Waveform):
+                value = value.quantity()
+            if np.ndim(value) == 1:
+                value = value * np.ones((ntrials, 1))
+            elif len(value) != ntrials:
+                raise Exception('Output arrays have different numbers of trials.')
+            raw_analog_outputs[self.analog_output[self.get_alias(name)]] = value * gain[self.get_alias(name)]
+        nsamples = [value.shape[1] for value in raw_analog_outputs.values()]
+        if not all([nsample==nsamples[0] for nsample in nsamples]):
+            raise Exception('Output arrays have different lengths.')
+
+        input_range = dict()
+        for name in analog_inputs:
+            if (self.min[name] is not None) and (self.max[name] is not None):
+                input_range[self.analog_input[name]] = (self.min[name]*gain[name], self.max[name]*gain[name])
+
+        results = self.acquire_batch_raw(analog_inputs=[self.analog_input[name] for name in analog_inputs],
+                                         analog_outputs=raw_analog_outputs, input_range=input_range)
+        scaled_results = [value/gain[name] for name, value in zip(analog_inputs, results)]
+
+        if len(inputs)==1:
+            return scaled_results[0]
+        else:
+            return scaled_results
+
+    def acquire_batch_raw(self, analog_inputs=[], analog_outputs={}, input_range={}):
+        '''
+        Acquires several trials of raw signals in volts, not scaled.
+        By default, trials are acquired sequentially with `acquire_raw`.
+
+        Parameters
+        ----------
+        analog_inputs : list of analog input channels (indexes)
+        analog_outputs : dictionary of analog output channels (key = output channel index,
+                         value = 2D array, trials x samples)
+        input_range : dictionary of (min, max) range for each input channel, in volt
+
+        Returns
+        -------
+        A list of 2D arrays (trials x samples), one for each input.
+        '''
+        ntrials = len(list(analog_outputs.values())[0])
+        trials = [self.acquire_raw(analog_inputs=analog_inputs,
+                                   analog_outputs=dict([(channel, value[i]) for channel, value in iteritems(analog_outputs)]),
+                                   digital_inputs=[], digital_outputs={}, input_range=input_range)
+                  for i in range(ntrials)]
+        return [np.array([trial[k] for trial in trials]) for k in range(len(analog_inputs))]
+
+    def stream(self, *inputs, **kwd):
+        '''
+        Starts a continuous acquisition of scaled signals, with hardware timing.
+        Samples are written into a ring buffer, from which blocks can be read with the `blocks()`
+        generator of the returned `Stream` object, or passed to callbacks (`add_callback()`).
+        Gains are read once at the start of acquisition.
+
+        Example:
+
+            with board.stream('V', block_size=1000) as stream:
+                for V in stream.blocks():
+                    ...
+
+        Parameters
+        ----------
+        inputs : list of analog input names
+        kwd : keywords, either an analog output signal (key = output channel name, value = array),
+              which is repeated periodically, or one of the following keywords.
+
+        block_size : number of samples per block
+        buffer_size : number of samples in the ring buffer (default: 100 blocks)
+        save : filename (.npy) to write the data while they are acquired (see `ChunkedWriter`)
+
+        Returns
+        -------
+        A running `Stream` object. Acquisition ends with `stop()`.
+        '''
+        block_size = kwd.pop('block_size', 1000)
+        buffer_size = kwd.pop('buffer_size', None)
+        filename = kwd.pop('save', None)
+        if buffer_size is None:
+            buffer_size = 100*block_size
+        analog_outputs = dict()
+        for keyword,value in iteritems(kwd):
+            if self.get_alias(keyword) in self.analog_output:
+                analog_outputs[keyword]=value
+            else:
+                raise AttributeError('{} is not an analog output channel'.format(keyword))
+
+        analog_inputs, digital_inputs = self.allocate_inputs(inputs)
+        if len(digital_inputs)>0:
+            raise AttributeError('Digital inputs cannot be streamed')
+
+        gain = self.resolve_gains(analog_inputs + list(analog_outputs.keys()))
+
+        raw_analog_outputs = dict()
+        for name, value in iteritems(analog_outputs):
+            if isinstance(value, Waveform):
+                value = value.quantity()
+            raw_analog_outputs[self.analog_output[self.get_alias(name)]] = value * gain[self.get_alias(name)]
+
+        input_range = dict()
+        for name in analog_inputs:
+            if (self.min[name] is not None) and (self.max[name] is not None):
+                input_range[self.analog_input[name]] = (self.min[name]*gain[name], self.max[name]*gain[name])
+
+        stream = Stream(self, inputs, [gain[name] for name in analog_inputs], block_size, buffer_size)
+        if filename is not None:
+            stream.writer = ChunkedWriter(filename, inputs, sampling_rate=self.sampling_rate)
+            stream.add_callback(stream.writer.write)
+        stream.start(analog_inputs=[self.analog_input[name] for name in analog_inputs],
+                     analog_outputs=raw_analog_outputs, input_range=input_range)
+        return stream
+
+    def start_stream_raw(self, analog_inputs=[], analog_outputs={}, input_range={}, block_size=1000, callback=None):
+        '''
+        Starts a continuous acquisition of raw signals in volts, not scaled.
+        This is the method that needs to be rewritten for a specific board.
+
+        Parameters
+        ----------
+        analog_inputs : list of analog input channels (indexes)
+        analog_outputs : dictionary of analog output channels (key = output channel index, value = array),
+                         the arrays are repeated periodically
+        input_range : dictionary of (min, max) range for each input channel, in volt
+        block_size : number of samples per block
+        callback : function called with each block, an array of raw values (channels x samples)
+        '''
+        raise NotImplementedError('Continuous acquisition is not implemented for this board')
+
+    def stop_stream_raw(self):
+        '''
+        Stops the continuous acquisition.
+        '''
+        raise NotImplementedError('Continuous acquisition is not implemented for this board')
+
     def acquire_raw(self, analog_inputs=[], analog_outputs={}, digital_inputs=[], digital_outputs={}, input_range={}):
         '''
         Acquires raw signals in volts, not scaled.
@@ -9,22 +9,30 @@ https://github.com/ni/nidaqmx-python/
 
 For the NI USB 6343, analog output range is +-10 V, input ranges are:
     +-0.2 V, +-1 V, +-5 V, +-10 V
+
+Tasks can be kept open between acquisitions (reuse_tasks=True). In that case, a task is only
+rebuilt when its configuration (channels, ranges, clock, sampling rate, number of samples) changes.
+The tasks are released with close().
 '''
 from .board import *
 import warnings
 from future.utils import iteritems
 try:
     import nidaqmx
+    import nidaqmx.stream_readers
     from nidaqmx.system import System
 except ImportError:
     warnings.warn('NI-DAQmx could not be imported')
 from numpy import zeros, array
 
 class NI(Board):
-    def __init__(self, device_name='Dev1', automatic_range_adjustment = False):
+    def __init__(self, device_name='Dev1', automatic_range_adjustment = False, reuse_tasks = False):
         Board.__init__(self)
         self.name = device_name # list of device names in Device()
         self.automatic_range_adjustment = automatic_range_adjustment # if True, adjusts output range automatically
+        self.reuse_tasks = reuse_tasks # if True, tasks are kept open between acquisitions
+        self.tasks = dict() # maps task type ('ai', 'di', 'ao', 'do') to (configuration, task)
+        self.stream_tasks = [] # tasks of the continuous acquisition
 
     def connect_counter_to_PFI(self, counter, PFI):
         System().connect_terms('/{}/Ctr{}InternalOutput'.format(self.name, counter),
@@ -48,6 +56,67 @@ class NI(Board):
         output_task_digital.start()
         return output_task_digital
 
+    def get_task(self, task_type, channels, clock, nsamples):
+        '''
+        Returns a configured task, reusing the existing one if its configuration has not changed.
+
+        Parameters
+        ----------
+        task_type : 'ai', 'di', 'ao' or 'do'
+        channels : list of channel specifications. For analog channels, (channel, min_val, max_val),
+                   with None for default ranges; for digital channels, channel numbers.
+        clock : source of the sample clock, or None if the task uses its own clock
+        nsamples : number of samples per channel
+        '''
+        configuration = (tuple(channels), clock, self.sampling_rate, nsamples)
+        if task_type in self.tasks:
+            previous_configuration, task = self.tasks.pop(task_type)
+            if previous_configuration == configuration:
+                self.tasks[task_type] = (configuration, task)
+                return task
+            task.close()
+
+        task = nidaqmx.Task()
+        if task_type == 'ai':
+            for channel, min_val, max_val in channels:
+                task.ai_channels.add_ai_voltage_chan(self.name+"/ai"+str(channel), min_val=min_val, max_val=max_val)
+        elif task_type == 'di':
+            for channel in channels: # 1 channel / line
+                task.di_channels.add_di_chan(self.name+"/line"+str(channel),
+                                             line_grouping=nidaqmx.constants.LineGrouping.CHAN_PER_LINE)
+        elif task_type == 'ao':
+            for channel, min_val, max_val in channels:
+                if min_val is None:
+                    task.ao_channels.add_ao_voltage_chan(self.name + "/ao" + str(channel))
+                else:
+                    task.ao_channels.add_ao_voltage_chan(self.name+"/ao"+str(channel), min_val=min_val, max_val=max_val)
+        elif task_type == 'do':
+            for channel in channels:
+                task.do_channels.add_do_chan(self.name+"/line"+str(channel))
+        task.timing.cfg_samp_clk_timing(self.sampling_rate, source=clock, samps_per_chan=nsamples)
+
+        self.tasks[task_type] = (configuration, task)
+        return task
+
+    def close_tasks(self, *task_types):
+        '''
+        Closes the open tasks of the given types (all tasks if none is given).
+        '''
+        if len(task_types) == 0:
+            task_types = list(self.tasks.keys())
+        for task_type in task_types:
+            if task_type in self.tasks:
+                _, task = self.tasks.pop(task_type)
+                task.close()
+
+    def close(self):
+        '''
+        Releases all tasks.
+        '''
+        if len(self.stream_tasks)>0:
+            self.stop_stream_raw()
+        self.close_tasks()
+
     def acquire_raw(self, analog_inputs=[], analog_outputs={}, digital_inputs=[], digital_outputs={}, input_range={}):
         '''
         Acquires raw signals in volts, not scaled.
@@ -65,7 +134,6 @@ class NI(Board):
         -------
         Values for inputs as a list of arrays, first analog inputs, then digital inputs.
         '''
-        dt = 1./self.sampling_rate
         if len(analog_outputs)>0:
             nsamples = len(list(analog_outputs.values())[0])
         else:
@@ -85,71 +153,58 @@ class NI(Board):
             clock = "/" + self.name + "/di/SampleClock"
             clock_name='di'
 
+        def source(task_type): # the task that generates the clock uses its own clock
+            if task_type == clock_name:
+                return None
+            else:
+                return clock
+
+        # Tasks that are not used in this acquisition are released
+        unused = [task_type for task_type, channels in [('ai', analog_inputs), ('di', digital_inputs),
+                                                        ('ao', analog_outputs), ('do', digital_outputs)]
+                  if len(channels) == 0]
+        self.close_tasks(*unused)
+
         # Read task
         # Analog input
         if len(analog_inputs)>0:
-            input_task = nidaqmx.Task()
+            channels = []
             for channel in analog_inputs:
                 if channel in input_range:
                     min_val, max_val = input_range[channel]
                 else:
                     min_val, max_val = -5., 5. # default values of add_ai_voltage_chan
-                input_task.ai_channels.add_ai_voltage_chan(self.name+"/ai"+str(channel), min_val=min_val, max_val=max_val)
-            if clock_name == 'ai':
-                input_task.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples)
-            else:
-                input_task.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples)
+                channels.append((channel, min_val, max_val))
+            input_task = self.get_task('ai', channels, source('ai'), nsamples)
 
         # Digital input
         if len(digital_inputs)>0:
-            input_task_digital = nidaqmx.Task()
-            for channel in digital_inputs: # 1 channel / line
-                input_task_digital.di_channels.add_di_chan(self.name+"/line"+str(channel),
-                                                   line_grouping=nidaqmx.constants.LineGrouping.CHAN_PER_LINE)
-            if clock_name == 'di':
-                input_task_digital.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples)
-            else:
-                input_task_digital.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples)
+            input_task_digital = self.get_task('di', digital_inputs, source('di'), nsamples)
 
         # Write task
         # Analog output
         if len(analog_outputs)>0:
-            output_task = nidaqmx.Task()
-            #write_data = zeros((len(analog_outputs)+len(digital_outputs),nsamples)) # perhaps should be a list instead
-            write_data = [None for _ in range(len(analog_outputs))]
-            i=0
+            channels = []
+            write_data = []
             for channel, value in iteritems(analog_outputs):
                 # Range
                 if self.automatic_range_adjustment:
                     min_val, max_val = min(value), max(value)+0.001 # adding 1 mV to avoid cases where min = max
-                    output_task.ao_channels.add_ao_voltage_chan(self.name+"/ao"+str(channel), min_val=min_val, max_val=max_val)
+                    channels.append((channel, min_val, max_val))
                 else:
-                    output_task.ao_channels.add_ao_voltage_chan(self.name + "/ao" + str(channel))
-                write_data[i]=value
-                i=i+1
-            if clock_name == 'ao':
-                output_task.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples)
-            else:
-                output_task.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples)
-            if i == 1:
+                    channels.append((channel, None, None))
+                write_data.append(value)
+            output_task = self.get_task('ao', channels, source('ao'), nsamples)
+            if len(write_data) == 1:
                 output_task.write(write_data[0], timeout = nidaqmx.constants.WAIT_INFINITELY)
             else:
                 output_task.write(array(write_data), timeout = nidaqmx.constants.WAIT_INFINITELY)
 
         # Digital output
         if len(digital_outputs)>0:
-            output_task_digital = nidaqmx.Task()
-            write_data_digital = [None for _ in range(len(digital_outputs))]
-            i = 0
-            for channel, value in iteritems(digital_outputs):
-                output_task_digital.do_channels.add_do_chan(self.name+"/line"+str(channel))
-                write_data_digital[i]=value
-                i=i+1
-            if clock_name == 'do':
-                output_task_digital.timing.cfg_samp_clk_timing(1. / dt, source=None, samps_per_chan=nsamples)
-            else:
-                output_task_digital.timing.cfg_samp_clk_timing(1./dt, source=clock, samps_per_chan = nsamples)
-            if i == 1:
+            write_data_digital = list(digital_outputs.values())
+            output_task_digital = self.get_task('do', list(digital_outputs.keys()), source('do'), nsamples)
+            if len(write_data_digital) == 1:
                 output_task_digital.write(write_data_digital[0], timeout = nidaqmx.constants.WAIT_INFINITELY)
             else:
                 output_task_digital.write(array(write_data_digital), timeout = nidaqmx.constants.WAIT_INFINITELY)
@@ -202,17 +257,83 @@ class NI(Board):
 
         data = data+data_digital
 
-        if len(analog_inputs)>0:
-            input_task.close()
-        if len(digital_inputs)>0:
-            input_task_digital.close()
-        if len(analog_outputs)>0:
-            output_task.close()
-        if len(digital_outputs)>0:
-            output_task_digital.close()
+        if not self.reuse_tasks:
+            self.close_tasks()
 
         return data
 
+    def start_stream_raw(self, analog_inputs=[], analog_outputs={}, input_range={}, block_size=1000, callback=None):
+        '''
+        Starts a continuous acquisition of raw signals in volts, not scaled.
+        Blocks are read into a preallocated array from a DAQmx every-N-samples callback.
+
+        Parameters
+        ----------
+        analog_inputs : list of analog input channels (indexes)
+        analog_outputs : dictionary of analog output channels (key = output channel index, value = array),
+                         the arrays are repeated periodically (regeneration)
+        input_range : dictionary of (min, max) range for each input channel, in volt
+        block_size : number of samples per block
+        callback : function called with each block, an array of raw values (channels x samples)
+        '''
+        # Finite tasks would hold the same channels
+        self.close_tasks()
+
+        CONTINUOUS = nidaqmx.constants.AcquisitionType.CONTINUOUS
+        self.stream_tasks = []
+
+        # Analog input
+        input_task = nidaqmx.Task()
+        for channel in analog_inputs:
+            if channel in input_range:
+                min_val, max_val = input_range[channel]
+            else:
+                min_val, max_val = -5., 5. # default values of add_ai_voltage_chan
+            input_task.ai_channels.add_ai_voltage_chan(self.name+"/ai"+str(channel), min_val=min_val, max_val=max_val)
+        if len(analog_outputs)>0:
+            clock = "/" + self.name + "/ao/SampleClock"
+        else:
+            clock = None
+        # The DAQmx buffer holds several blocks, in case the callback is late
+        input_task.timing.cfg_samp_clk_timing(self.sampling_rate, source=clock, sample_mode=CONTINUOUS,
+                                              samps_per_chan=10*block_size)
+        reader = nidaqmx.stream_readers.AnalogMultiChannelReader(input_task.in_stream)
+        block = zeros((len(analog_inputs), block_size))
+
+        def read_block(task_handle, event_type, number_of_samples, callback_data):
+            reader.read_many_sample(block, number_of_samples_per_channel=block_size, timeout=0)
+            callback(block)
+            return 0
+
+        input_task.register_every_n_samples_acquired_into_buffer_event(block_size, read_block)
+        self.stream_tasks.append(input_task)
+
+        # Analog output
+        if len(analog_outputs)>0:
+            output_task = nidaqmx.Task()
+            for channel in analog_outputs:
+                output_task.ao_channels.add_ao_voltage_chan(self.name + "/ao" + str(channel))
+            nsamples = len(list(analog_outputs.values())[0])
+            output_task.timing.cfg_samp_clk_timing(self.sampling_rate, sample_mode=CONTINUOUS, samps_per_chan=nsamples)
+            write_data = list(analog_outputs.values())
+            if len(write_data) == 1:
+                output_task.write(write_data[0])
+            else:
+                output_task.write(array(write_data))
+            self.stream_tasks.append(output_task)
+
+        # Start the input first, as it waits for the output clock
+        for task in self.stream_tasks:
+            task.start()
+
+    def stop_stream_raw(self):
+        '''
+        Stops the continuous acquisition.
+        '''
+        for task in self.stream_tasks[::-1]:
+            task.stop()
+            task.close()
+        self.stream_tasks = []
 
 if __name__ == '__main__':
     # print "Initializing"
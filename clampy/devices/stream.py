@@ -0,0 +1,167 @@
+'''
+Continuous acquisition
+
+Blocks of samples produced by the board are scaled and written into a preallocated ring buffer.
+Consumers either pull blocks with a generator, or register callbacks that are called on each block.
+Memory is bounded by the size of the ring buffer, whatever the duration of the recording.
+'''
+import threading
+import numpy as np
+
+__all__ = ['RingBuffer', 'Stream']
+
+class RingBuffer(object):
+    '''
+    A preallocated circular buffer of multichannel samples.
+
+    Samples are numbered from 0 since the start of acquisition. Only the last `capacity` samples are kept.
+    '''
+    def __init__(self, nchannels, capacity):
+        '''
+        Parameters
+        ----------
+        nchannels : number of channels
+        capacity : number of samples per channel kept in the buffer
+        '''
+        self.data = np.zeros((nchannels, capacity))
+        self.capacity = capacity
+        self.total = 0 # number of samples written since the start
+        self.writing = 0 # end of the write in progress (= total if none)
+        self.condition = threading.Condition()
+
+    def write(self, block, scale=None):
+        '''
+        Writes a block of samples (channels x samples), optionally divided by scale (one value per channel).
+        Returns the position of the first sample of the block.
+        '''
+        n = block.shape[1]
+        if n > self.capacity:
+            raise IOError('Block of {} samples does not fit in a buffer of {} samples'.format(n, self.capacity))
+        with self.condition:
+            position = self.total
+            self.writing = position + n # samples before writing - capacity are being overwritten
+        start = position % self.capacity
+        end = min(start + n, self.capacity)
+        # Two pieces if the block wraps around
+        for target, source in [(slice(start, end), slice(0, end - start)),
+                               (slice(0, n - (end - start)), slice(end - start, n))]:
+            if scale is None:
+                self.data[:, target] = block[:, source]
+            else:
+                np.divide(block[:, source], scale[:, None], out=self.data[:, target])
+        with self.condition:
+            self.total += n
+            self.condition.notify_all()
+        return position
+
+    def read(self, position, n):
+        '''
+        Returns a copy of samples [position, position+n).
+        Raises an IOError if these samples have already been overwritten.
+        '''
+        if position < self.writing - self.capacity:
+            raise IOError('Ring buffer overflow: samples {} to {} have been overwritten'.format(position, position + n))
+        index = np.arange(position, position + n) % self.capacity
+        data = self.data[:, index]
+        if position < self.writing - self.capacity: # overwritten while copying
+            raise IOError('Ring buffer overflow: samples {} to {} have been overwritten'.format(position, position + n))
+        return data
+
+    def wait(self, total, timeout=None):
+        '''
+        Waits until `total` samples have been written, or until timeout (in second).
+        Returns True if the samples are available.
+        '''
+        with self.condition:
+            return self.condition.wait_for(lambda: self.total >= total, timeout)
+
+class Stream(object):
+    '''
+    A continuous acquisition, returned by `Board.stream`.
+
+    Blocks are given as acquire() returns its results: a list of scaled arrays,
+    or a single array if there is just one input.
+    '''
+    def __init__(self, board, inputs, gains, block_size, buffer_size):
+        '''
+        Parameters
+        ----------
+        board : the acquisition board
+        inputs : list of input names
+        gains : array of gains for the inputs
+        block_size : number of samples per channel in each block
+        buffer_size : number of samples per channel in the ring buffer
+        '''
+        self.board = board
+        self.inputs = inputs
+        self.gains = np.array(gains, dtype=float)
+        self.block_size = block_size
+        self.buffer = RingBuffer(len(inputs), buffer_size)
+        self.callbacks = []
+        self.running = False
+        self.writer = None # ChunkedWriter, if the data are saved
+
+    def add_callback(self, callback):
+        '''
+        Registers a function called with each new block, in the acquisition thread.
+        The callback should return quickly.
+        '''
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def write_raw(self, block):
+        '''
+        Called by the board with each new block of raw data (channels x samples, in volt).
+        '''
+        position = self.buffer.write(block, scale=self.gains)
+        if len(self.callbacks) > 0:
+            scaled = self.format(self.buffer.read(position, block.shape[1]))
+            for callback in self.callbacks:
+                callback(scaled)
+
+    def format(self, data):
+        if len(self.inputs) == 1:
+            return data[0]
+        else:
+            return list(data)
+
+    def blocks(self, timeout=None):
+        '''
+        Generator of scaled blocks, starting from the current position.
+        Stops when the acquisition is stopped, or if no block arrives within timeout (in second).
+        Raises an IOError if the consumer is too slow and data have been overwritten.
+        '''
+        position = self.buffer.total - self.buffer.total % self.block_size
+        while True:
+            if not self.buffer.wait(position + self.block_size, timeout=0.1 if timeout is None else timeout):
+                if self.running and (timeout is None):
+                    continue
+                break
+            yield self.format(self.buffer.read(position, self.block_size))
+            position += self.block_size
+
+    @property
+    def samples(self):
+        '''
+        Number of samples acquired since the start.
+        '''
+        return self.buffer.total
+
+    def start(self, **kwd):
+        self.running = True
+        self.board.start_stream_raw(block_size=self.block_size, callback=self.write_raw, **kwd)
+
+    def stop(self):
+        if self.running:
+            self.board.stop_stream_raw()
+            self.running = False
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,141 @@
+'''
+Fast display of sweeps with matplotlib
+
+Sweeps are decimated to the width of the axes in pixels, keeping the minimum and maximum
+in each pixel column, so that the displayed trace looks the same as the full trace.
+Only the traces are redrawn at each frame (blitting); the whole figure is redrawn only when the
+vertical axis changes, i.e., when data leave the current range.
+'''
+import numpy as np
+
+__all__ = ['decimate', 'SweepDisplay']
+
+def decimate(x, y, n):
+    '''
+    Reduces a trace to n bins, keeping the minimum and maximum of y in each bin.
+    Returns x and y with 2 points per bin (or the original trace if it is shorter).
+    '''
+    if len(y) <= 2 * n:
+        return x, y
+    starts = np.unique(np.linspace(0, len(y), n, endpoint=False).astype(int))
+    xd = np.repeat(x[starts], 2)
+    yd = np.empty(2 * len(starts))
+    yd[0::2] = np.minimum.reduceat(y, starts)
+    yd[1::2] = np.maximum.reduceat(y, starts)
+    return xd, yd
+
+class SweepDisplay(object):
+    '''
+    Displays sweeps in matplotlib axes, with blitting and decimation.
+
+    Example:
+
+        display = SweepDisplay(ax, t/ms, artists=[text])
+        def update():
+            I = engine.latest()
+            if I is not None:
+                display.set_data(I/pA)
+                text.set_text(...)
+        display.start(update)
+        show()
+    '''
+    def __init__(self, ax, x, lines=1, artists=(), autoscale=True, margin=0.1, **kwds):
+        '''
+        Parameters
+        ----------
+        ax : matplotlib axes
+        x : horizontal values of sweep samples
+        lines : number of lines
+        artists : other artists of the axes updated at each frame (e.g. a text)
+        autoscale : if True, the vertical axis is rescaled when data leave the current range
+        margin : relative margin added around data when rescaling
+        kwds : keyword arguments passed to plot
+        '''
+        self.ax = ax
+        self.canvas = ax.figure.canvas
+        self.x = np.asarray(x)
+        self.autoscale = autoscale
+        self.margin = margin
+        self.lines = [ax.plot(self.x, np.zeros(len(self.x)), animated=True, **kwds)[0] for _ in range(lines)]
+        self.artists = list(artists)
+        for artist in self.artists:
+            artist.set_animated(True)
+        ax.set_xlim(self.x[0], self.x[-1])
+        self.data = [None] * lines
+        self.background = None
+        self.redraw = True # full redraw needed
+        self.timer = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        # The figure was redrawn (without the animated artists): save the background
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.lines + self.artists:
+            self.ax.draw_artist(artist)
+
+    def set_data(self, *ys):
+        '''
+        Sets the sweeps of all lines, and rescales the vertical axis if needed.
+        '''
+        width = max(int(self.ax.bbox.width), 1)
+        for line, y in zip(self.lines, ys):
+            line.set_data(*decimate(self.x[:len(y)], np.asarray(y), width))
+        self.data = list(ys)
+        if self.autoscale:
+            ymin, ymax = self.ax.get_ylim()
+            low, high = self.data_range()
+            if (low < ymin) or (high > ymax):
+                self.rescale()
+
+    def data_range(self):
+        '''
+        Returns the minimum and maximum of displayed data.
+        '''
+        values = [line.get_ydata() for line in self.lines if len(line.get_ydata()) > 0]
+        values = np.concatenate(values)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return 0., 0.
+        return values.min(), values.max()
+
+    def rescale(self):
+        '''
+        Sets the vertical axis to the range of the data.
+        '''
+        low, high = self.data_range()
+        span = high - low
+        if span == 0:
+            span = max(abs(high), 1.)
+        self.ax.set_ylim(low - self.margin * span, high + self.margin * span)
+        self.redraw = True
+
+    def draw(self):
+        '''
+        Draws the lines and artists, redrawing the whole figure only if needed.
+        '''
+        if self.redraw or (self.background is None) or not self.canvas.supports_blit:
+            self.redraw = False
+            self.canvas.draw() # calls on_draw
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_artists()
+            self.canvas.blit(self.ax.bbox)
+        self.canvas.flush_events()
+
+    def start(self, update, interval=10):
+        '''
+        Calls update() then draws, every interval (in ms).
+        '''
+        def frame():
+            update()
+            self.draw()
+        self.timer = self.canvas.new_timer(interval=interval)
+        self.timer.add_callback(frame)
+        self.timer.start()
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.stop()
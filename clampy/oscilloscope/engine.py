@@ -0,0 +1,139 @@
+'''
+Oscilloscope engine
+
+Sweeps are acquired repeatedly in a background thread, and the display takes the most recent one.
+Sweeps that arrive while the display is busy are dropped, so that the sweep rate and the display rate
+are independent.
+
+Example:
+
+    engine = OscilloscopeEngine(lambda: board.acquire('I', Vc=Vc))
+    engine.start()
+    def update(i):
+        I = engine.latest()
+        ...
+    anim = animation.FuncAnimation(fig, update)
+    show()
+    engine.stop()
+'''
+import threading
+import time
+
+__all__ = ['LatestValue', 'OscilloscopeEngine']
+
+class LatestValue(object):
+    '''
+    A queue holding only the last value put in it.
+    '''
+    def __init__(self):
+        self.value = None
+        self.new = False
+        self.dropped = 0 # number of values replaced before being read
+        self.condition = threading.Condition()
+
+    def put(self, value):
+        with self.condition:
+            if self.new:
+                self.dropped += 1
+            self.value = value
+            self.new = True
+            self.condition.notify_all()
+
+    def get(self, timeout=0):
+        '''
+        Returns the last value if it has not been read yet, otherwise waits for a new value
+        until timeout (in second; None: no timeout). Returns None if there is no new value.
+        '''
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.new, timeout):
+                return None
+            self.new = False
+            return self.value
+
+class OscilloscopeEngine(object):
+    '''
+    Acquires sweeps repeatedly in a background thread.
+
+    The acquisition function is called repeatedly and its results are made available with `latest`.
+    It can read global variables (e.g. the amplitude of the command) which are changed by the GUI.
+    Functions of the GUI that control the hardware should hold `lock`, which is held during acquisition.
+    '''
+    def __init__(self, acquire, process=None):
+        '''
+        Parameters
+        ----------
+        acquire : function with no argument, returning a sweep
+        process : optional function applied to each sweep in the acquisition thread (e.g. analysis
+            or recording), whose result is passed to the display instead of the sweep
+        '''
+        self.acquire = acquire
+        self.process = process
+        self.frames = LatestValue()
+        self.lock = threading.RLock()
+        self.sweeps = 0 # number of acquired sweeps
+        self.sweep_rate = 0. # sweeps per second, averaged over the last sweeps
+        self.error = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stops the acquisition, after the current sweep.
+        '''
+        self.running = False
+        if (self.thread is not None) and (self.thread is not threading.current_thread()):
+            self.thread.join()
+        self.thread = None
+
+    def run(self):
+        last_time = time.time()
+        while self.running:
+            try:
+                with self.lock:
+                    sweep = self.acquire()
+                if self.process is not None:
+                    sweep = self.process(sweep)
+            except Exception as e: # reported to the display by `latest`
+                self.error = e
+                self.running = False
+                self.frames.put(None)
+                break
+            self.sweeps += 1
+            t = time.time()
+            self.sweep_rate = 0.9 * self.sweep_rate + 0.1 / max(t - last_time, 1e-9)
+            last_time = t
+            self.frames.put(sweep)
+
+    def latest(self, timeout=0):
+        '''
+        Returns the last sweep if it has not been displayed yet, otherwise waits for the next one
+        until timeout (in second). Returns None if there is no new sweep.
+        Raises the exception of the acquisition thread if acquisition failed.
+        '''
+        frame = self.frames.get(timeout)
+        if self.error is not None:
+            raise self.error
+        return frame
+
+    @property
+    def dropped(self):
+        '''
+        Number of sweeps that were not displayed.
+        '''
+        return self.frames.dropped
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
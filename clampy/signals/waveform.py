@@ -2,14 +2,24 @@
 Basic waveforms
 
 The duration argument should perhaps become obsolete
+
+Waveforms can also be built lazily with `Waveform` objects (`Constant`, `Ramp`, `Ticks`, `Steps`, `Sequence`),
+which can be multiplied by scalars and are rendered to arrays only when needed.
+Rendered arrays are cached by content, and can be written directly into a preallocated buffer:
+
+    Vc = Sequence([Constant(T0, dt)*0, Constant(T1, dt)*10*mV, Constant(T2, dt)*0])
+    I = board.acquire('I', Vc=Vc*factor)
 '''
+import hashlib
+from collections import OrderedDict
 from numpy import *
 try:
     from brian2.units import Quantity
 except ImportError:
     pass
 
-__all__ = ['sequence', 'constant', 'ramp', 'ticks', 'steps']
+__all__ = ['sequence', 'constant', 'ramp', 'ticks', 'steps',
+           'Waveform', 'Array', 'Constant', 'Ramp', 'Ticks', 'Sequence', 'Steps', 'Scaled', 'RenderCache', 'render_cache']
 
 def steps(step_list, dt=1):
     # List of constants steps, specified as (x, t)
@@ -24,6 +34,9 @@ def steps(step_list, dt=1):
 
 def sequence(signal_list):
     # Concatenates signals and uses the units of the first element
+    # If one of the signals is a Waveform, returns a Sequence
+    if any([isinstance(signal, Waveform) for signal in signal_list]):
+        return Sequence(signal_list)
     try:
         unit = Quantity(1,signal_list[0].dimensions)
     except:
@@ -52,10 +65,300 @@ def ticks(duration=None, dt=1, rate=None, t0=0., t1=None, t2=None):
     '''
     trigger = constant(duration=duration, dt=dt, dtype=bool, t1=t1, t2=t2)
     trigger[:] = False
+    trigger[_tick_times(duration, dt, rate, t0)] = True
+    return trigger
+
+def _tick_times(duration, dt, rate, t0):
+    # Indexes of ticks (see `ticks`)
     T = int(1. / rate / dt)
     # Align with t0
     T1 = int((t0) / dt) - T * arange(0, int((t0) * rate))
     T2 = int((t0) / dt) + T * arange(1,int((duration - t0) * rate))
-    trigger_times = hstack((T1, T2))
-    trigger[trigger_times] = True
-    return trigger
+    return hstack((T1, T2))
+
+def _nsamples(duration=None, dt=1, t1=None, t2=None):
+    # Number of samples of a segment, as in `constant`
+    if t1 is not None:
+        return int(t2 / dt) - int(t1/dt)
+    else:
+        return int(duration/dt)
+
+def _split_unit(x):
+    # Returns the value of x in SI units as a plain array, and its Brian unit (None if dimensionless)
+    try:
+        if isinstance(x, Quantity) and not x.is_dimensionless:
+            return asarray(x), Quantity(1, x.dimensions)
+    except NameError: # Brian is not installed
+        pass
+    return asarray(x), None
+
+def _product_unit(unit1, unit2):
+    # Unit of a product (None if dimensionless)
+    if unit1 is None:
+        return unit2
+    elif unit2 is None:
+        return unit1
+    unit = unit1 * unit2
+    if not isinstance(unit, Quantity) or unit.is_dimensionless:
+        return None
+    return unit
+
+class RenderCache(object):
+    '''
+    A cache of rendered waveforms, indexed by content.
+    The least recently used arrays are discarded when the total size exceeds max_size (in bytes).
+    '''
+    def __init__(self, max_size=2**28):
+        self.max_size = max_size
+        self.arrays = OrderedDict() # key -> array
+        self.size = 0
+
+    def get(self, key):
+        if key in self.arrays:
+            self.arrays.move_to_end(key)
+            return self.arrays[key]
+        return None
+
+    def put(self, key, array):
+        if (key in self.arrays) or (array.nbytes > self.max_size):
+            return
+        array.flags.writeable = False # shared between users
+        self.arrays[key] = array
+        self.size += array.nbytes
+        while self.size > self.max_size:
+            _, old = self.arrays.popitem(last=False)
+            self.size -= old.nbytes
+
+    def clear(self):
+        self.arrays.clear()
+        self.size = 0
+
+render_cache = RenderCache()
+
+class Waveform(object):
+    '''
+    A lazy waveform, rendered to an array with `render`.
+
+    Waveforms can be multiplied or divided by scalars, and concatenated with `Sequence`.
+    They can be used in place of arrays (e.g. `len(w)`, `asarray(w)`).
+    Rendered arrays are in SI units, without units; the Brian unit of the waveform, if any, is `unit`
+    (see `quantity`).
+    '''
+    __array_ufunc__ = None # so that numpy scalars * waveform gives a waveform
+    dtype = float
+    unit = None
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def key(self):
+        '''
+        Returns a hashable description of the content of the waveform.
+        '''
+        raise NotImplementedError
+
+    def render_into(self, out):
+        # Writes the waveform into array out
+        raise NotImplementedError
+
+    def render(self, out=None):
+        '''
+        Returns the waveform as an array.
+
+        Parameters
+        ----------
+        out : an array of the same length, where the waveform is written.
+              If None, a read-only array is returned, which may be shared with other users.
+        '''
+        key = self.key()
+        rendered = render_cache.get(key)
+        if out is None:
+            if rendered is None:
+                rendered = empty(len(self), dtype=self.dtype)
+                self.render_into(rendered)
+                render_cache.put(key, rendered)
+            return rendered
+        if len(out) != len(self):
+            raise ValueError('Output buffer has {} samples, the waveform has {}'.format(len(out), len(self)))
+        if rendered is None:
+            self.render_into(out)
+            render_cache.put(key, out.astype(self.dtype))
+        else:
+            copyto(out, rendered, casting='unsafe')
+        return out
+
+    def quantity(self):
+        '''
+        Returns the rendered waveform, with its unit if it has one.
+        '''
+        if self.unit is None:
+            return self.render()
+        return self.render() * self.unit
+
+    def __array__(self, dtype=None):
+        return asarray(self.render(), dtype=dtype)
+
+    def __mul__(self, factor):
+        return Scaled(self, factor)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, factor):
+        return Scaled(self, 1. / factor)
+
+    __div__ = __truediv__
+
+    def __neg__(self):
+        return Scaled(self, -1.)
+
+class Array(Waveform):
+    '''
+    A waveform given by an array.
+    The array should not be modified afterwards.
+    '''
+    def __init__(self, values):
+        self.values, self.unit = _split_unit(values)
+        self.dtype = self.values.dtype
+        self.hash = hashlib.sha1(ascontiguousarray(self.values).view(uint8)).hexdigest()
+
+    def __len__(self):
+        return len(self.values)
+
+    def key(self):
+        return ('array', self.hash, str(self.dtype), len(self))
+
+    def render_into(self, out):
+        out[:] = self.values
+
+class Constant(Waveform):
+    '''
+    A constant waveform (1 by default).
+    '''
+    def __init__(self, duration=None, dt=1, value=1., dtype=float, t1=None, t2=None):
+        self.n = _nsamples(duration, dt, t1, t2)
+        value, self.unit = _split_unit(value)
+        self.value = value.item()
+        self.dtype = dtype
+
+    def __len__(self):
+        return self.n
+
+    def key(self):
+        return ('constant', self.n, self.value, str(self.dtype))
+
+    def render_into(self, out):
+        out[:] = self.value
+
+class Ramp(Waveform):
+    '''
+    A ramp from start to end (0 to 1 by default).
+    '''
+    def __init__(self, duration=None, dt=1, start=0., end=1., t1=None, t2=None):
+        self.n = _nsamples(duration, dt, t1, t2)
+        (start, unit1), (end, unit2) = _split_unit(start), _split_unit(end)
+        self.start, self.end = start.item(), end.item()
+        self.unit = unit1 if unit1 is not None else unit2
+
+    def __len__(self):
+        return self.n
+
+    def key(self):
+        return ('ramp', self.n, self.start, self.end)
+
+    def render_into(self, out):
+        out[:] = linspace(self.start, self.end, self.n)
+
+class Ticks(Waveform):
+    '''
+    Ticks (True/False) regularly placed at specified rate, synchronized at t0 (see `ticks`).
+    '''
+    dtype = bool
+
+    def __init__(self, duration, dt=1, rate=None, t0=0.):
+        self.n = _nsamples(duration, dt)
+        self.duration, self.dt, self.rate, self.t0 = duration, dt, rate, t0
+
+    def __len__(self):
+        return self.n
+
+    def key(self):
+        return ('ticks', self.n, self.duration, self.dt, self.rate, self.t0)
+
+    def render_into(self, out):
+        out[:] = False
+        out[_tick_times(self.duration, self.dt, self.rate, self.t0)] = True
+
+class Scaled(Waveform):
+    '''
+    A waveform multiplied by a scalar.
+    '''
+    def __init__(self, waveform, factor):
+        self.waveform = waveform
+        self.scale = factor # possibly with units
+        factor, unit = _split_unit(factor)
+        self.factor = float(factor)
+        self.unit = _product_unit(waveform.unit, unit)
+        self.n = len(waveform)
+
+    def __len__(self):
+        return self.n
+
+    def key(self):
+        return ('scaled', self.factor, self.waveform.key())
+
+    def render_into(self, out):
+        multiply(self.waveform.render(), self.factor, out=out)
+
+    def render(self, out=None):
+        # Scaled versions are not cached when rendered into a buffer, since factors change often
+        if out is None:
+            return Waveform.render(self)
+        if len(out) != len(self):
+            raise ValueError('Output buffer has {} samples, the waveform has {}'.format(len(out), len(self)))
+        self.render_into(out)
+        return out
+
+    def __mul__(self, factor):
+        return Scaled(self.waveform, self.scale * factor)
+
+    __rmul__ = __mul__
+
+class Sequence(Waveform):
+    '''
+    A concatenation of waveforms (or arrays).
+    '''
+    def __init__(self, waveforms):
+        self.waveforms = [w if isinstance(w, Waveform) else Array(w) for w in waveforms]
+        self.n = sum([len(w) for w in self.waveforms])
+        if all([w.dtype == bool for w in self.waveforms]):
+            self.dtype = bool
+        units = [w.unit for w in self.waveforms if w.unit is not None]
+        if len(units) > 0: # unit of the first element with units, as in `sequence`
+            self.unit = units[0]
+        self.content = ('sequence',) + tuple([w.key() for w in self.waveforms])
+
+    def __len__(self):
+        return self.n
+
+    def key(self):
+        return self.content
+
+    def render_into(self, out):
+        i = 0
+        for w in self.waveforms:
+            w.render(out=out[i:i + len(w)])
+            i += len(w)
+
+class Steps(Sequence):
+    '''
+    Constant steps, specified as a list of (x, t), where t is the end time (see `steps`).
+    '''
+    def __init__(self, step_list, dt=1):
+        t2 = [t for _, t in step_list]
+        t1 = [0]+t2[:-1]
+        x = [a for a, _ in step_list]
+        dtype = type(x[0])
+        if dtype is not bool:
+            dtype = float
+        Sequence.__init__(self, [Constant(dt=dt, t1=t1i, t2=t2i, value=xi, dtype=dtype)
+                                 for t1i, t2i, xi in zip(t1, t2, x)])
@@ -0,0 +1,21 @@
+'''
+Compares the direct and FFT methods to calculate correlations in full_kernel,
+for different recording durations and kernel sizes.
+'''
+from numpy import *
+from time import time
+from clampy.analysis.electrode_compensation import correlations
+
+def timing(v, i, ksize, method, repeats=3):
+    t = time()
+    for _ in range(repeats):
+        correlations(v, i, ksize, method)
+    return (time()-t)/repeats
+
+print('N       ksize   direct (s)  fft (s)')
+for N in [10000, 100000, 1000000]:
+    v, i = random.randn(N), random.randn(N)
+    for ksize in [5, 10, 20, 50, 100, 1000, 5000]:
+        if ksize*N > 1e9:
+            continue
+        print('{:<8}{:<8}{:<12.5f}{:.5f}'.format(N, ksize, timing(v, i, ksize, 'direct'), timing(v, i, ksize, 'fft')))
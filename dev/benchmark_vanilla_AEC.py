@@ -0,0 +1,35 @@
+'''
+Compares the Python recursion previously used in vanilla_AEC.electrode_kernel
+to remove the membrane kernel, with the IIR filter (lfilter) now used.
+'''
+from numpy import *
+from scipy.signal import lfilter
+from time import time
+
+def remove_km_loop(RawK, x, tau):
+    alpha = x / tau
+    lambd = exp(-1. / tau)
+    Y = zeros(len(RawK))
+    Y[0] = alpha / (alpha + 1.) * RawK[0]
+    for i in range(1, len(RawK)):
+        Y[i] = (alpha * RawK[i] + lambd * Y[i - 1]) / (1 + alpha)
+    return RawK - Y
+
+def remove_km_lfilter(RawK, x, tau):
+    alpha = x / tau
+    lambd = exp(-1. / tau)
+    return RawK - lfilter([alpha / (1 + alpha)], [1., -lambd / (1 + alpha)], RawK)
+
+print('ksize   loop (ms)   lfilter (ms)   max difference')
+for ksize in [100, 1000, 10000]:
+    t = arange(ksize)
+    K = exp(-t / 3.) + .1 * exp(-t / (ksize / 5.))
+    results = []
+    timings = []
+    for f in [remove_km_loop, remove_km_lfilter]:
+        t1 = time()
+        for _ in range(20):
+            result = f(K, .5, ksize / 5.)
+        timings.append((time() - t1) / 20 * 1000)
+        results.append(result)
+    print('{:<8}{:<12.3f}{:<15.4f}{:.2e}'.format(ksize, timings[0], timings[1], abs(results[0] - results[1]).max()))
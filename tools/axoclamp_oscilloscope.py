@@ -5,8 +5,9 @@ for the Axoclamp 900A.
 from clampy import *
 from pylab import *
 from clampy.signals import *
+from clampy.oscilloscope import *
+from clampy.analysis import SealTest
 #from init_rig import *
-import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button, RadioButtons, Slider
 
@@ -54,23 +55,34 @@ fig, ax = plt.subplots()
 plt.subplots_adjust(bottom=0.4)
 plt.xlabel('Time (ms)')
 plt.ylabel('V (mV)')
-resistance_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
 
-subplot(211)
+axV = subplot(211)
+resistance_text = axV.text(0.05, 0.9, '', transform=axV.transAxes)
 t = dt*arange(len(Ic))
-xlim(0,max(t/ms))
+displayV = SweepDisplay(axV, t/ms, artists=[resistance_text])
 ylim(-150,100)
-lineV, = plot(t/ms,0*t)
 ylabel('V (mV)')
-subplot(212)
-xlim(0,max(t/ms))
-lineI, = plot(t/ms,0*t)
+axI = subplot(212)
+displayI = SweepDisplay(axI, t/ms)
 ylim(-5,5)
 xlabel('Time (ms)')
 ylabel('I (nA)')
 
 current_clamp = True
 
+def acquire():
+    clamp_mode = current_clamp # the mode may change during acquisition
+    if clamp_mode:
+        V = board.acquire('V', Ic1=Ic)
+        I = Ic
+    else:
+        V, I = board.acquire('V', 'I_TEVC', Vc=Vc)
+    return clamp_mode, V, I
+
+engine = OscilloscopeEngine(acquire) # acquires in the background
+cc_test = SealTest(Ic, dt, voltage_clamp=False)
+vc_test = SealTest(Vc, dt)
+
 def display_title():
     ax.set_title("Electrode Current")
 
@@ -82,29 +94,35 @@ def callback(event):
     #y = line.get_ydata()
     #ax.set_ylim(min(y),max(y))
 
+# The amplifier is not controlled during acquisition
 def change_mode(event):
     global current_clamp
-    if mode_button.value_selected == 'CC':
-        current_clamp = True
-        amplifier.current_clamp(0)
-        amplifier.current_clamp(1)
-    else: # TEVC
-        current_clamp = False
-        amplifier.TEVC()
-        amplifier.set_external_command_enable(True,1)
+    with engine.lock:
+        if mode_button.value_selected == 'CC':
+            current_clamp = True
+            amplifier.current_clamp(0)
+            amplifier.current_clamp(1)
+        else: # TEVC
+            current_clamp = False
+            amplifier.TEVC()
+            amplifier.set_external_command_enable(True,1)
 
 def change_bridge(event):
-    amplifier.set_bridge_resistance(bridge_button.val*1e6,0)
+    with engine.lock:
+        amplifier.set_bridge_resistance(bridge_button.val*1e6,0)
 
 def change_capa(event):
-    amplifier.set_cap_neut_enable(True, 0)
-    amplifier.set_cap_neut_level(capa_button.val,0)
+    with engine.lock:
+        amplifier.set_cap_neut_enable(True, 0)
+        amplifier.set_cap_neut_level(capa_button.val,0)
 
 def change_gain(event):
-    amplifier.set_loop_gain(gain_button.val,1)
+    with engine.lock:
+        amplifier.set_loop_gain(gain_button.val,1)
 
 def change_lag(event):
-    amplifier.set_loop_lag(lag_button.val, 1)
+    with engine.lock:
+        amplifier.set_loop_lag(lag_button.val, 1)
 
 ax_mode = plt.axes([0.05, 0.025, 0.2, 0.125], frameon=False)
 mode_button = RadioButtons(ax_mode, ['CC', 'TEVC'])
@@ -129,22 +147,24 @@ lag_button.on_changed(change_lag)
 
 display_title()
 
-def update(i):
-    if current_clamp:
-        V = board.acquire('V', Ic1=Ic)
-        I = Ic
+def update():
+    sweep = engine.latest()
+    if sweep is None: # no new sweep
+        return
+    clamp_mode, V, I = sweep
+    # Calculate offset and resistance, in the mode of the sweep
+    if clamp_mode:
+        R = cc_test.analyze(V)['resistance']
     else:
-        V, I = board.acquire('V', 'I_TEVC', Vc=Vc)
-    # Calculate offset and resistance
-    V0 = median(V[:int(T0/dt)]) # calculated on initial pause
-    Vpeak = median(V[int((T0+2*T1/3.)/dt):int((T0+T1)/dt)]) # calculated on last third of the pulse
-    R = (Vpeak-V0)/I0
+        R = vc_test.analyze(I)['resistance']
     # Plot
-    lineV.set_ydata(V/mV)
-    lineI.set_ydata(I/nA)
+    displayV.set_data(V/mV)
+    displayI.set_data(I/nA)
     resistance_text.set_text('{:.1f} MOhm'.format(R/Mohm))
-    return lineV,
+    displayI.draw()
 
-anim = animation.FuncAnimation(fig,update)
+engine.start()
+displayV.start(update)
 
 show()
+engine.stop()
@@ -3,13 +3,13 @@ An oscilloscope showing the voltage response to a pulse
 
 TODO:
 * maybe add slider or so for current amplitude and duration
-* calculate resistance, V0 etc
 '''
 from clampy import *
 from pylab import *
 from clampy.signals import *
+from clampy.oscilloscope import *
+from clampy.analysis import SealTest
 from init_rig import *
-import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
 
@@ -30,9 +30,8 @@ plt.ylabel('V (mV)')
 resistance_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
 
 t = dt*arange(len(Ic))
-xlim(0,max(t/ms))
+display = SweepDisplay(ax, t/ms, artists=[resistance_text])
 ylim(-150,100)
-line, = plot(t/ms,0*t)
 
 
 def display_title():
@@ -55,20 +54,27 @@ switch_button.on_clicked(callback)
 
 display_title()
 
-def update(i):
+def acquire():
     if swap:
-        V = board.acquire('V2', Ic2=Ic)
+        return board.acquire('V2', Ic2=Ic)
     else:
-        V = board.acquire('V', Ic=Ic)
+        return board.acquire('V', Ic=Ic)
+
+engine = OscilloscopeEngine(acquire) # acquires in the background
+seal_test = SealTest(Ic, dt, voltage_clamp=False)
+
+def update():
+    V = engine.latest()
+    if V is None: # no new sweep
+        return
     # Calculate offset and resistance
-    V0 = median(V[:int(T0/dt)]) # calculated on initial pause
-    Vpeak = median(V[int((T0+2*T1/3.)/dt):int((T0+T1)/dt)]) # calculated on last third of the pulse
-    R = (Vpeak-V0)/I0
+    R = seal_test.analyze(V)['resistance']
     # Plot
-    line.set_ydata(V/mV)
+    display.set_data(V/mV)
     resistance_text.set_text('{:.1f} MOhm'.format(R/Mohm))
-    return line,
 
-anim = animation.FuncAnimation(fig,update)
+engine.start()
+display.start(update)
 
 show()
+engine.stop()
@@ -4,8 +4,9 @@ An oscilloscope showing the current response to a pulse
 from clampy import *
 from pylab import *
 from clampy.signals import *
+from clampy.oscilloscope import *
+from clampy.analysis import SealTest
 from init_rig import *
-import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button, CheckButtons, RadioButtons, TextBox
 
@@ -16,9 +17,9 @@ V0 = 1*mV  # This will be scaled with a factor later, assuming that the sequence
 T0 = 50*ms
 T1 = 10*ms
 T2 = 50*ms
-Vc = sequence([constant(T0, dt) * 0 * mV,
-               constant(T1, dt) * V0,
-               constant(T2, dt) * 0 * mV])
+Vc = Sequence([Constant(T0, dt) * 0 * mV, # rendered at each sweep into the board's buffer
+               Constant(T1, dt) * V0,
+               Constant(T2, dt) * 0 * mV])
 
 fig, ax = plt.subplots()
 plt.subplots_adjust(bottom=0.2)
@@ -27,22 +28,15 @@ plt.ylabel('I (pA)')
 resistance_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
 
 t = dt*arange(len(Vc))
-xlim(0, max(t/ms))
-ylim(auto=True)
-line, = plot(t/ms, 0*t/ms)
+display = SweepDisplay(ax, t/ms, artists=[resistance_text])
 
 
 def adjust_callback(event):
-    y = line.get_ydata()
-    ax.set_ylim(1.05*min(y), 1.05*max(y))
+    display.rescale()
 
 
 def autoadjust_callback(event):
-    autoadjust = autoadjust_checkbox.get_status()[0]
-    if autoadjust:
-        ax.set_ylim(auto=True)
-    else:
-        ax.set_ylim(auto=False)
+    display.autoscale = autoadjust_checkbox.get_status()[0]
 
 
 factor = -10.  # clamped voltage in mV
@@ -83,27 +77,30 @@ stim_value = TextBox(ax_stim_value, 'VC (mV):', '-10')
 stim_value.on_submit(value_callback)
 
 
-def update(i):
-    I = board.acquire('I', Vc=Vc*factor)
+def acquire():
+    clamp_factor = factor
+    return clamp_factor, board.acquire('I', Vc=Vc*clamp_factor)
+
+engine = OscilloscopeEngine(acquire) # acquires in the background
+seal_test = SealTest(Vc, dt)
+
+
+def update():
+    sweep = engine.latest()
+    if sweep is None: # no new sweep
+        return
+    factor, I = sweep
     ## Calculate offset and resistance
+    R = seal_test.analyze(I, amplitude=V0*factor)['resistance']
     if abs(factor) > 0:
-        I0 = median(I[:int(T0/dt)]) # calculated on initial pause
-        Ipeak = median(I[int((T0+2*T1/3.)/dt):int((T0+T1)/dt)]) # calculated on last third of the pulse
-        R = V0/(Ipeak-I0)
         resistance_text.set_text('{:.1f} MOhm'.format(R / Mohm))
     else:
         resistance_text.set_text('[no clamp]')
     # Plot
-    line.set_ydata(I/pA)
-    autoadjust = autoadjust_checkbox.get_status()[0]
-    if autoadjust:
-        ax.set_ylim(auto=True)
-        # recompute the ax.dataLim
-        ax.relim()
-        # update ax.viewLim using the new dataLim
-        ax.autoscale_view()
-    return line,
-
-anim = animation.FuncAnimation(fig, update)
+    display.set_data(I/pA)
+
+engine.start()
+display.start(update)
 
 show()
+engine.stop()
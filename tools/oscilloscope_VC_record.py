@@ -1,13 +1,19 @@
 '''
 An oscilloscope showing the current response to a pulse
+
+Recordings contain a `resistance` array, as in earlier versions, and a `seal_test` array with
+the results of `SealTest`: sample, time, then one column per field of `SealTest.fields`
+(baseline, steady state, resistance, access resistance, membrane resistance, capacitance).
 '''
 import os
+import threading
 
 from pylab import *
 from clampy.signals import *
 from clampy.data_management import SessionRecorder
+from clampy.oscilloscope import *
+from clampy.analysis import SealTest
 from init_rig import *
-import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button, CheckButtons, RadioButtons, TextBox
 
@@ -18,9 +24,9 @@ V0 = 1*mV  # This will be scaled with a factor later, assuming that the sequence
 T0 = 50*ms
 T1 = 10*ms
 T2 = 50*ms
-Vc = sequence([constant(T0, dt) * 0 * mV,
-               constant(T1, dt) * V0,
-               constant(T2, dt) * 0 * mV])
+Vc = Sequence([Constant(T0, dt) * 0 * mV, # rendered at each sweep into the board's buffer
+               Constant(T1, dt) * V0,
+               Constant(T2, dt) * 0 * mV])
 
 fig, ax = plt.subplots()
 plt.subplots_adjust(bottom=0.2)
@@ -29,22 +35,15 @@ plt.ylabel('I (pA)')
 resistance_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
 
 t = dt*arange(len(Vc))
-xlim(0, max(t/ms))
-ylim(auto=True)
-line, = plot(t/ms, 0*t/ms)
+display = SweepDisplay(ax, t/ms, artists=[resistance_text])
 
 
 def adjust_callback(event):
-    y = line.get_ydata()
-    ax.set_ylim(1.05*min(y), 1.05*max(y))
+    display.rescale()
 
 
 def autoadjust_callback(event):
-    autoadjust = autoadjust_checkbox.get_status()[0]
-    if autoadjust:
-        ax.set_ylim(auto=True)
-    else:
-        ax.set_ylim(auto=False)
+    display.autoscale = autoadjust_checkbox.get_status()[0]
 
 
 factor = -10.  # clamped voltage in mV
@@ -72,17 +71,24 @@ def selection_callback(event):
 experiment_start = datetime.datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
 recorder = SessionRecorder(os.path.join('./data',
                                         '{}_voltage_clamp'.format(experiment_start)),
-                           dt=dt)
+                           dt=dt, flush_interval=5.) # data are written to disk every 5 s
 
 recording = False
+finalizing = None # thread saving the last recording
 def record_callback(event):
-    global recording
-    recording = not recording
+    global recording, finalizing
+    if (not recording) and (finalizing is not None):
+        finalizing.join() # the previous recording must be saved first
+    with engine.lock: # not during acquisition
+        recording = not recording
+        if recording:
+            recorder.start_recording()
     if recording:
-        recorder.start_recording()
         record_button.label.set_text('Stop')
     else:
-        recorder.stop_recording()
+        # Files are consolidated in the background, without blocking acquisition and display
+        finalizing = threading.Thread(target=recorder.stop_recording)
+        finalizing.start()
         record_button.label.set_text('Record')
 
 
@@ -103,13 +109,19 @@ record_button = Button(ax_record, 'Record')
 record_button.on_clicked(record_callback)
 
 
-def update(sample):
+seal_test = SealTest(Vc, dt)
+sample = 0 # sweep number
+def acquire():
+    # Acquires, analyzes and records a sweep, in the acquisition thread
+    global sample
+    sample += 1
+    clamp_factor = factor
     sample_start = time.time()
-    I, V_hold = board.acquire('I', 'V', Vc=Vc*factor)
+    I, V_hold = board.acquire('I', 'V', Vc=Vc*clamp_factor)
     if recording:
         recorder.record('I', sample, sample_start, I)
         recorder.record('V_hold', sample, sample_start, V_hold)
-        recorder.record('V_command', sample, sample_start, [factor])
+        recorder.record('V_command', sample, sample_start, [clamp_factor])
         if pressure is not None:
             recorder.record('pressure', sample, time.time(),
                             [pressure.measure()])
@@ -128,28 +140,31 @@ def update(sample):
 
 
     ## Calculate offset and resistance
-    if abs(factor) > 0:
-        I0 = median(I[:int(T0/dt)]) # calculated on initial pause
-        Ipeak = median(I[int((T0+2*T1/3.)/dt):int((T0+T1)/dt)]) # calculated on last third of the pulse
-        R = V0/(Ipeak-I0)
-        resistance_text.set_text('{:.1f} MOhm'.format(R / Mohm))
-        if recording:
-            recorder.record('resistance', sample, sample_start, [R])
-    else:
+    results = seal_test.analyze(I, amplitude=V0*clamp_factor, t=sample_start)
+    if recording:
+        recorder.record('resistance', sample, sample_start, [results['resistance']])
+        recorder.record_seal_test(sample, sample_start, results, seal_test.fields)
+    return I, results['resistance']
+
+engine = OscilloscopeEngine(acquire) # acquires in the background
+
+
+def update():
+    sweep = engine.latest()
+    if sweep is None: # no new sweep
+        return
+    I, R = sweep
+    if isnan(R):
         resistance_text.set_text('[no clamp]')
-        if recording:
-            recorder.record('resistance', sample, sample_start, [np.nan])
+    else:
+        resistance_text.set_text('{:.1f} MOhm'.format(R / Mohm))
     # Plot
-    line.set_ydata(I/pA)
-    autoadjust = autoadjust_checkbox.get_status()[0]
-    if autoadjust:
-        ax.set_ylim(auto=True)
-        # recompute the ax.dataLim
-        ax.relim()
-        # update ax.viewLim using the new dataLim
-        ax.autoscale_view()
-    return line,
-
-anim = animation.FuncAnimation(fig, update)
+    display.set_data(I/pA)
+
+engine.start()
+display.start(update)
 
 show()
+engine.stop()
+if finalizing is not None:
+    finalizing.join()